@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BACKTEST_CACHE_DIR = os.environ.get("BACKTEST_CACHE_DIR") or "backtests"
+
+result_file = "result.json"
+trades_file = "trades.parquet"
+
+# bump when a strategy or Portfolio changes its results, old results are not read any more
+BACKTEST_CACHE_VERSION = 1
+
+# backtests read these collections, new documents make a new data watermark
+INPUT_COLLECTIONS = ["stock_infos_quarter", "prices_quarter", "dailyPrices"]
+
+
+def get_data_watermarks(repository):
+    # documents of one crawl share createdAt, the count also changes when more of them come
+    watermarks = {}
+
+    for collection in INPUT_COLLECTIONS:
+        created_at = repository.find_max_created_at(collection)
+
+        watermarks[collection] = {
+            "createdAt": created_at.isoformat() if created_at else None,
+            "count": repository.count(collection),
+        }
+
+    return watermarks
+
+
+class BacktestCache:
+    # {root}/{key}/result.json and trades.parquet,
+    # key is a hash of the backtest config and the data watermarks
+    def __init__(self, root=BACKTEST_CACHE_DIR):
+        self.root = root
+
+    def get_key(self, config, watermarks):
+        payload = json.dumps(
+            {
+                "version": BACKTEST_CACHE_VERSION,
+                "config": config,
+                "watermarks": watermarks,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def load(self, key):
+        # None if the backtest is not cached
+        path = os.path.join(self.root, key, result_file)
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as f:
+            result = json.load(f)
+
+        trades_path = os.path.join(self.root, key, trades_file)
+        result["trades"] = (
+            pd.read_parquet(trades_path)
+            if os.path.exists(trades_path)
+            else pd.DataFrame()
+        )
+
+        return result
+
+    def save(self, key, result, trade_ledger):
+        key_dir = os.path.join(self.root, key)
+        os.makedirs(key_dir, exist_ok=True)
+
+        trade_ledger.to_parquet(os.path.join(key_dir, trades_file))
+
+        # result file is written last, a backtest without it is not cached
+        path = os.path.join(key_dir, result_file)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get_or_run(self, config, watermarks, run):
+        # run: function returning (result, trade_ledger) of the backtest
+        key = self.get_key(config, watermarks)
+        result = self.load(key)
+
+        if result is not None:
+            print(f"backtest {config} is cached ({key})")
+            return result
+
+        result, trade_ledger = run()
+        self.save(key, result, trade_ledger)
+
+        result["trades"] = trade_ledger.to_df()
+
+        return result
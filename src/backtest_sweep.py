@@ -0,0 +1,168 @@
+import os
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from dotenv import load_dotenv
+
+import factor_engine
+from factor_store import FactorStore
+from price_index import PriceIndex, MISSING_PRICE
+from quarter_price import find_quarter_prices_df
+from repository import get_repository
+from vector_portfolio import VectorPortfolio, get_price_panel
+from stock_analysis import generate_quarters, get_EBITDA_panel, rebalance
+
+load_dotenv()
+
+SWEEP_WORKERS = int(os.environ.get("SWEEP_WORKERS") or os.cpu_count())
+
+STRATEGIES = ["EBITDA", "market"]
+MARKET_STOCK_ID = "0050"
+
+# market data of the worker process, set once by init_worker
+worker_data = {}
+
+
+def get_configs(grid):
+    # grid: {parameter: list of values}, one config per combination
+    keys = list(grid)
+
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def get_config_quarters(config):
+    return generate_quarters(config["start_quarter"], config["end_quarter"])
+
+
+def load_market_data(repository, configs):
+    # everything a backtest reads, so workers never query the repository:
+    # EBITDA panel of all quarters and price of every stock it may hold
+    quarters = sorted(
+        {
+            quarter
+            for config in configs
+            for quarter in get_config_quarters(config) + [config["end_quarter"]]
+        }
+    )
+    max_count = max(config["portfolio_count"] for config in configs)
+
+    price_index = PriceIndex(max_size=None)
+    price_index.preload(repository, quarters)
+
+    factors_df = FactorStore().refresh(repository, price_index)
+    panel = get_EBITDA_panel(factors_df, quarters)
+
+    stocks_rank_df = factor_engine.rank_panel(panel, [max_count])[max_count]
+    stock_ids = set(stocks_rank_df.stack().dropna()) | {MARKET_STOCK_ID}
+
+    missing_keys = [
+        (stock_id, quarter)
+        for stock_id in sorted(stock_ids)
+        for quarter in quarters
+        if price_index.get(stock_id, quarter) is None
+    ]
+
+    if missing_keys:
+        prices_df = find_quarter_prices_df(repository, missing_keys)
+
+        for stock_id, quarter, price in zip(
+            prices_df["stockId"], prices_df["會計年季度"], prices_df["收盤價"].tolist()
+        ):
+            price_index.put(
+                stock_id, quarter, MISSING_PRICE if pd.isna(price) else price
+            )
+
+    return {"panel": panel, "prices": dict(price_index.prices)}
+
+
+def init_worker(market_data):
+    worker_data["panel"] = market_data["panel"]
+
+    prices = market_data["prices"]
+    quarters = sorted({quarter for _, quarter in prices})
+    stock_ids = sorted({stock_id for stock_id, _ in prices})
+
+    worker_data["price_panel"] = get_price_panel(prices, quarters, stock_ids)
+
+
+# result columns of run_backtest, None if the backtest failed
+result_columns = ["assets", "profit", "winRate", "tradeCount"]
+
+
+def run_backtest(config):
+    account_quarters = get_config_quarters(config)
+    end_quarter = config["end_quarter"]
+    count = config["portfolio_count"]
+
+    try:
+        if config["strategy"] == "EBITDA":
+            panel = worker_data["panel"].reindex(account_quarters)
+            stocks_rank_df = factor_engine.rank_panel(panel, [count])[count]
+        elif config["strategy"] == "market":
+            stocks_rank_df = pd.DataFrame(
+                {quarter: [MARKET_STOCK_ID] for quarter in account_quarters}
+            )
+        else:
+            raise ValueError(config["strategy"], "unknown strategy")
+
+        portfolio = VectorPortfolio(worker_data["price_panel"], config["init_money"])
+
+        rebalance(portfolio, stocks_rank_df, account_quarters, end_quarter)
+
+        return {
+            **config,
+            "assets": portfolio.assets_history[-1]["assets"],
+            "profit": portfolio.get_history_profit(end_quarter),
+            "winRate": portfolio.win_rate,
+            "tradeCount": len(portfolio.trade_history),
+            "error": None,
+        }
+    except Exception as e:
+        traceback.print_exc()
+        return {
+            **config,
+            **{column: None for column in result_columns},
+            "error": str(e),
+        }
+
+
+def run_sweep(repository, configs, workers=SWEEP_WORKERS):
+    market_data = load_market_data(repository, configs)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(market_data,)
+    ) as executor:
+        results = list(executor.map(run_backtest, configs))
+
+    return pd.DataFrame(results)
+
+
+def main():
+    repository = get_repository()
+
+    configs = get_configs(
+        {
+            "strategy": STRATEGIES,
+            "start_quarter": ["20161", "20171", "20181"],
+            "end_quarter": ["20211"],
+            "init_money": [3000],
+            "portfolio_count": [10, 20, 30, 40, 50],
+        }
+    )
+
+    results_df = run_sweep(repository, configs)
+
+    repository.close()
+
+    # failed configs are listed last with their error
+    print(results_df.sort_values("assets", ascending=False).to_string(index=False))
+
+    failed_df = results_df[results_df["error"].notna()]
+    if not failed_df.empty:
+        print(f"{len(failed_df)} of {len(results_df)} configs failed")
+        print(failed_df[[*configs[0], "error"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
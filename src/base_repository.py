@@ -0,0 +1,283 @@
+import os
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+
+from bulk_writer import BULK_BATCH_SIZE
+from trades_frame import to_naive_utc
+
+load_dotenv()
+
+# documents per batch when streaming chips and daily prices into DataFrame
+LOADER_BATCH_SIZE = int(os.environ.get("LOADER_BATCH_SIZE") or 500)
+
+date_column = "日期"
+quarter_column = "會計年季度"
+# same as branch_registry.branch_id_column
+branch_id_column = "分點ID"
+
+# chips fields used by Stock.get_trade_df
+chips_projection = {
+    "_id": 0,
+    date_column: 1,
+    f"data.{branch_id_column}": 1,
+    "data.分點代號": 1,
+    "data.分點名稱": 1,
+    "data.買張": 1,
+    "data.賣張": 1,
+}
+
+# stock_infos_quarter filter of EBITDA strategy: not top 200 company,
+# with 普通股股本 and non-zero 毛利 and 營業利益
+EBITDA_candidate_query = {
+    "isTop200Company": {"$ne": True},
+    "普通股股本": {"$gt": 0},
+    "毛利": {"$ne": 0},
+    "營業利益": {"$ne": 0},
+}
+
+
+def is_EBITDA_candidate(info):
+    # same as EBITDA_candidate_query for backends without mongo queries
+    capital = info.get("普通股股本")
+
+    return (
+        info.get("isTop200Company") is not True
+        and isinstance(capital, (int, float))
+        and capital > 0
+        and info.get("毛利") != 0
+        and info.get("營業利益") != 0
+    )
+
+
+class Repository(ABC):
+    # every backend implements find / upsert_many / distinct_dates / delete_many,
+    # the queries used by Stock, Portfolio and the scripts are built on them
+    @abstractmethod
+    def find(
+        self,
+        collection,
+        stock_id=None,
+        stock_ids=None,
+        quarter=None,
+        since_date=None,
+        after_date=None,
+        before_date=None,
+        sort=None,
+        limit=None,
+    ):
+        pass
+
+    @abstractmethod
+    def upsert_many(self, collection, docs, key_columns):
+        # same as `$setOnInsert`, documents already stored are kept
+        pass
+
+    @abstractmethod
+    def distinct_dates(self, collection, since_date=None):
+        pass
+
+    @abstractmethod
+    def delete_many(self, collection, stock_id, since_date):
+        pass
+
+    def close(self):
+        pass
+
+    def bulk_upserter(self, collection, key_columns, batch_size=BULK_BATCH_SIZE):
+        return BufferedUpserter(self, collection, key_columns, batch_size)
+
+    def find_one(self, collection, **kwargs):
+        docs = self.find(collection, limit=1, **kwargs)
+
+        return docs[0] if docs else None
+
+    def find_stock(self, stock_id):
+        return self.find_one("stocks", stock_id=stock_id)
+
+    def find_stocks(self, should_skip=None):
+        stocks = self.find("stocks")
+
+        if should_skip is not None:
+            stocks = [
+                stock for stock in stocks if stock.get("shouldSkip") == should_skip
+            ]
+
+        return sorted(stocks, key=lambda stock: stock["stockId"])
+
+    def find_latest(self, collection, stock_id):
+        return self.find_one(collection, stock_id=stock_id, sort=-1)
+
+    def find_quarter_price(self, stock_id, quarter):
+        return self.find_one("prices_quarter", stock_id=stock_id, quarter=quarter)
+
+    def find_quarter_prices(self, quarters):
+        return [
+            price_quarter
+            for quarter in quarters
+            for price_quarter in self.find("prices_quarter", quarter=quarter)
+        ]
+
+    def find_created_since(self, collection, created_at=None):
+        # stockId, 會計年季度 and createdAt of documents created at or after created_at,
+        # missing fields are left out like a mongo projection
+        columns = ["stockId", quarter_column, "createdAt"]
+
+        return [
+            {column: doc[column] for column in columns if column in doc}
+            for doc in self.find(collection)
+            if not created_at
+            or (doc.get("createdAt") and to_naive_utc(doc["createdAt"]) >= created_at)
+        ]
+
+    def find_max_created_at(self, collection):
+        created_ats = [
+            to_naive_utc(doc["createdAt"])
+            for doc in self.find(collection)
+            if doc.get("createdAt")
+        ]
+
+        return max(created_ats, default=None)
+
+    def count(self, collection):
+        return len(self.find(collection))
+
+    def find_first_daily_price(self, stock_id, after_date, before_date):
+        return self.find_one(
+            "dailyPrices",
+            stock_id=stock_id,
+            after_date=after_date,
+            before_date=before_date,
+            sort=1,
+        )
+
+    def find_daily_prices(self, stock_id, since_date):
+        return self.find(
+            "dailyPrices", stock_id=stock_id, since_date=since_date, sort=1
+        )
+
+    def find_chips(self, stock_id, since_date):
+        return self.find("chips", stock_id=stock_id, since_date=since_date, sort=1)
+
+    def find_quarter_infos(self, quarter):
+        return self.find("stock_infos_quarter", quarter=quarter)
+
+    def find_infos_of_quarters(self, quarters):
+        return [
+            info for quarter in quarters for info in self.find_quarter_infos(quarter)
+        ]
+
+    def find_EBITDA_candidate_infos(self, quarters):
+        return [
+            info
+            for info in self.find_infos_of_quarters(quarters)
+            if is_EBITDA_candidate(info)
+        ]
+
+    def iter_batches(self, docs, batch_size):
+        for idx in range(0, len(docs), batch_size):
+            yield docs[idx : idx + batch_size]
+
+    def iter_chips(self, stock_id, since_date, batch_size=LOADER_BATCH_SIZE):
+        return self.iter_batches(self.find_chips(stock_id, since_date), batch_size)
+
+    def iter_daily_prices(self, stock_id, since_date, batch_size=LOADER_BATCH_SIZE):
+        return self.iter_batches(
+            self.find_daily_prices(stock_id, since_date), batch_size
+        )
+
+    def find_stocks_chips(self, stock_ids, since_date):
+        # chips of many stocks in one query, not sorted
+        return self.find("chips", stock_ids=stock_ids, since_date=since_date)
+
+    def find_stocks_daily_prices(self, stock_ids, since_date, before_date=None):
+        return self.find(
+            "dailyPrices",
+            stock_ids=stock_ids,
+            since_date=since_date,
+            before_date=before_date,
+        )
+
+    def find_daily_branch_nets(self, stock_id, since_date, branches=None):
+        # one item per day: branch id (or branch code of rows before BranchRegistry),
+        # branch name and net quantities of each row,
+        # branches: only rows of these branch ids and codes
+        daily_nets = []
+
+        for chip in self.find_chips(stock_id, since_date):
+            rows = [
+                (row.get(branch_id_column, row.get("分點代號")), row)
+                for row in chip["data"]
+            ]
+
+            if branches is not None:
+                rows = [(branch, row) for branch, row in rows if branch in branches]
+
+            daily_nets.append(
+                {
+                    "_id": chip[date_column],
+                    "branches": [branch for branch, _ in rows],
+                    "names": [row.get("分點名稱") for _, row in rows],
+                    "nets": [row["買張"] - row["賣張"] for _, row in rows],
+                }
+            )
+
+        return daily_nets
+
+    def find_branches(self):
+        return self.find("branches")
+
+    def register_branch(self, code, name):
+        # single process backends, next id is simply the largest one + 1
+        branches = self.find_branches()
+
+        for branch in branches:
+            if branch["code"] == code:
+                return branch
+
+        branch = {
+            "branchId": max([branch["branchId"] for branch in branches], default=0) + 1,
+            "code": code,
+            "name": name,
+        }
+        self.upsert_many("branches", [branch], ["code"])
+
+        return branch
+
+
+class BufferedUpserter:
+    # same interface as bulk_writer.BulkUpserter for backends other than mongo
+    def __init__(self, repository, collection, key_columns, batch_size):
+        self.repository = repository
+        self.collection = collection
+        self.key_columns = key_columns
+        self.batch_size = batch_size
+        self.docs = []
+        self.upserted_count = 0
+        self.error_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def add(self, doc):
+        self.docs.append(doc)
+
+        if len(self.docs) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, docs):
+        for doc in docs:
+            self.add(doc)
+
+    def flush(self):
+        if not self.docs:
+            return
+
+        docs = self.docs
+        self.docs = []
+
+        self.upserted_count += self.repository.upsert_many(
+            self.collection, docs, self.key_columns
+        )
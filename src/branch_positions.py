@@ -0,0 +1,159 @@
+import sys
+from datetime import datetime
+import pandas as pd
+from dotenv import load_dotenv
+
+from branch_registry import BranchRegistry
+from repository import get_repository
+from trades_frame import to_naive_utc
+
+load_dotenv()
+
+date_column = "日期"
+positions_collection = "branch_positions"
+
+# one snapshot per stock per month, running position of each branch since first chips day
+# until the last chips day of the month (so far for the latest month),
+# {stockId, 日期: last chips day in snapshot, branches: [branch id], positions: [int]},
+# branches at 0 are left out
+
+
+def get_month(date):
+    return (date.year, date.month)
+
+
+def get_snapshot(repository, stock_id, before_date=None):
+    # latest snapshot, or latest one before before_date
+    if before_date:
+        return repository.find_one(
+            positions_collection, stock_id=stock_id, before_date=before_date, sort=-1
+        )
+
+    return repository.find_latest(positions_collection, stock_id)
+
+
+def snapshot_to_dict(snapshot):
+    if not snapshot:
+        return {}
+
+    return dict(zip(snapshot["branches"], snapshot["positions"]))
+
+
+def add_chip(positions, chip, get_row_id):
+    for row in chip["data"]:
+        branch_id = get_row_id(row)
+        positions[branch_id] = positions.get(branch_id, 0) + row["買張"] - row["賣張"]
+
+
+def to_snapshot(stock_id, chip, positions):
+    positions = {
+        branch_id: position for branch_id, position in positions.items() if position
+    }
+
+    return {
+        "stockId": stock_id,
+        date_column: chip[date_column],
+        "branches": list(positions.keys()),
+        "positions": list(positions.values()),
+        "createdAt": datetime.now(),
+    }
+
+
+def update_positions(repository, stock_id, branch_registry, since_date=None):
+    # since_date: earliest chips day written in this run, snapshots after it are rebuilt
+    latest_snapshot = get_snapshot(repository, stock_id)
+
+    if (
+        since_date
+        and latest_snapshot
+        and to_naive_utc(latest_snapshot[date_column]) >= to_naive_utc(since_date)
+    ):
+        repository.delete_many(positions_collection, stock_id, since_date)
+        latest_snapshot = get_snapshot(repository, stock_id, since_date)
+
+    positions = snapshot_to_dict(latest_snapshot)
+    after_date = latest_snapshot[date_column] if latest_snapshot else None
+
+    chips = repository.find("chips", stock_id=stock_id, after_date=after_date, sort=1)
+
+    if not chips:
+        return 0
+
+    # snapshot of an unfinished month is written again with the new days
+    if latest_snapshot and get_month(chips[0][date_column]) == get_month(after_date):
+        repository.delete_many(positions_collection, stock_id, after_date)
+
+    writer = repository.bulk_upserter(positions_collection, ["stockId", date_column])
+
+    for chip, next_chip in zip(chips, chips[1:] + [None]):
+        add_chip(positions, chip, branch_registry.get_row_id)
+
+        if not next_chip or get_month(next_chip[date_column]) != get_month(
+            chip[date_column]
+        ):
+            writer.add(to_snapshot(stock_id, chip, positions))
+
+    writer.flush()
+
+    return writer.upserted_count
+
+
+def get_positions_before(repository, stock_id, before_date, branch_registry):
+    # snapshot of the month before, plus chips days of the month until before_date
+    snapshot = get_snapshot(repository, stock_id, before_date)
+    positions = snapshot_to_dict(snapshot)
+
+    chips = repository.find(
+        "chips",
+        stock_id=stock_id,
+        after_date=snapshot[date_column] if snapshot else None,
+        before_date=before_date,
+        sort=1,
+    )
+
+    for chip in chips:
+        add_chip(positions, chip, branch_registry.find_row_id)
+
+    return positions
+
+
+def get_position_change(repository, stock_id, since_date, branch_registry):
+    # position change of each branch for chips days >= since_date, as two snapshots subtraction,
+    # None if positions of the stock are not built yet
+    latest_snapshot = get_snapshot(repository, stock_id)
+
+    if not latest_snapshot:
+        return None
+
+    latest = pd.Series(snapshot_to_dict(latest_snapshot), dtype="int64")
+    base = pd.Series(
+        get_positions_before(repository, stock_id, since_date, branch_registry),
+        dtype="int64",
+    )
+
+    change = latest.sub(base, fill_value=0)
+
+    return change[change != 0]
+
+
+def main():
+    # rebuild all snapshots: python branch_positions.py <stock id|all>
+    repository = get_repository()
+    branch_registry = BranchRegistry(repository)
+
+    stock_id = sys.argv[1] if len(sys.argv) > 1 else input("input stock id or 'all': ")
+
+    if stock_id == "all":
+        stock_ids = [stock["stockId"] for stock in repository.find_stocks()]
+    else:
+        stock_ids = [stock_id]
+
+    for stock_id in stock_ids:
+        print(f"stock id: {stock_id}")
+        update_positions(repository, stock_id, branch_registry, datetime.min)
+
+    repository.close()
+
+
+if __name__ == "__main__":
+    main()
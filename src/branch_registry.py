@@ -0,0 +1,125 @@
+import os
+import sys
+import threading
+from pymongo import MongoClient, ASCENDING, UpdateOne
+from dotenv import load_dotenv
+
+from repository import as_repository
+
+load_dotenv()
+
+MONGO_URL = os.environ.get("MONGO_URL")
+
+branches_collection = "branches"
+chips_collection = "chips"
+
+# chip row stores branch id instead of 分點代號 / 分點名稱
+branch_id_column = "分點ID"
+
+
+class BranchRegistry:
+    def __init__(self, repository):
+        self.repository = as_repository(repository)
+        self.lock = threading.Lock()
+        self.id_by_code = {}
+        self.name_by_id = {}
+
+        for branch in self.repository.find_branches():
+            self.id_by_code[branch["code"]] = branch["branchId"]
+            self.name_by_id[branch["branchId"]] = branch["name"]
+
+    def get_id(self, code, name):
+        if code in self.id_by_code:
+            return self.id_by_code[code]
+
+        with self.lock:
+            if code not in self.id_by_code:
+                branch = self.repository.register_branch(code, name)
+
+                self.name_by_id[branch["branchId"]] = branch["name"]
+                self.id_by_code[code] = branch["branchId"]
+
+        return self.id_by_code[code]
+
+    def get_row_id(self, row):
+        if branch_id_column in row:
+            return row[branch_id_column]
+
+        return self.get_id(row["分點代號"], row["分點名稱"])
+
+    def find_row_id(self, row):
+        # unlike get_row_id never register new branch, unknown branch keeps its name
+        if branch_id_column in row:
+            return row[branch_id_column]
+
+        return self.id_by_code.get(row["分點代號"], row["分點名稱"])
+
+    def get_name(self, branch_id):
+        return self.name_by_id.get(branch_id, branch_id)
+
+    def encode_row(self, row):
+        return {
+            branch_id_column: self.get_row_id(row),
+            "買張": row["買張"],
+            "賣張": row["賣張"],
+            "買金額": row["買金額"],
+            "賣金額": row["賣金額"],
+        }
+
+
+def migrate(db, stock_ids, batch_size=100):
+    registry = BranchRegistry(db)
+
+    for stock_id in stock_ids:
+        print(f"stock id: {stock_id}")
+
+        chips = db[chips_collection].find(
+            {"stockId": stock_id, f"data.{branch_id_column}": {"$exists": False}},
+            {"data": 1},
+        )
+
+        operations = []
+
+        for chip in chips:
+            operations.append(
+                UpdateOne(
+                    {"_id": chip["_id"]},
+                    {
+                        "$set": {
+                            "data": [registry.encode_row(row) for row in chip["data"]]
+                        }
+                    },
+                )
+            )
+
+            if len(operations) >= batch_size:
+                db[chips_collection].bulk_write(operations, ordered=False)
+                operations = []
+
+        if operations:
+            db[chips_collection].bulk_write(operations, ordered=False)
+
+    print(f"{len(registry.id_by_code)} branches registered")
+
+
+def main():
+    mongo_client = MongoClient(MONGO_URL)
+    db = mongo_client.get_default_database()
+
+    db[branches_collection].create_index([("code", ASCENDING)], unique=True)
+    db[branches_collection].create_index([("branchId", ASCENDING)], unique=True)
+
+    stock_id = sys.argv[1] if len(sys.argv) > 1 else input("input stock id or 'all': ")
+
+    if stock_id == "all":
+        stock_ids = db[chips_collection].distinct("stockId")
+    else:
+        stock_ids = [stock_id]
+
+    migrate(db, sorted(stock_ids))
+
+    mongo_client.close()
+
+
+if __name__ == "__main__":
+    main()
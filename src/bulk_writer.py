@@ -0,0 +1,65 @@
+import os
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE") or 1000)
+
+
+class BulkUpserter:
+    # group `$setOnInsert` upserts into unordered bulk_write batches
+    def __init__(self, collection, key_columns, batch_size=BULK_BATCH_SIZE):
+        self.collection = collection
+        self.key_columns = key_columns
+        self.batch_size = batch_size
+        self.operations = []
+        self.upserted_count = 0
+        self.error_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def add(self, doc):
+        self.operations.append(
+            UpdateOne(
+                {key: doc[key] for key in self.key_columns},
+                {"$setOnInsert": doc},
+                upsert=True,
+            )
+        )
+
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, docs):
+        for doc in docs:
+            self.add(doc)
+
+    def flush(self):
+        if not self.operations:
+            return
+
+        operations = self.operations
+        self.operations = []
+
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            self.upserted_count += result.upserted_count
+        except BulkWriteError as e:
+            details = e.details
+            write_errors = details.get("writeErrors", [])
+
+            self.upserted_count += details.get("nUpserted", 0)
+            self.error_count += len(write_errors)
+
+            print(
+                f"collection {self.collection.name}: {len(write_errors)} of "
+                f"{len(operations)} upserts failed in batch"
+            )
+            for error in write_errors:
+                print(f"  {error['op']['q']}: {error['errmsg']}")
@@ -1,5 +1,4 @@
 import os
-from pymongo import MongoClient
 
 #  from pymongo import MongoClient, ASCENDING
 import matplotlib.pyplot as plt
@@ -12,16 +11,19 @@ from dateutil.relativedelta import relativedelta
 from pathlib import Path
 
 from stock import Stock
+from stock_batch import StockBatchLoader
+from branch_registry import BranchRegistry
+from parquet_mirror import ParquetMirror
+from repository import get_repository
 
 load_dotenv()
 
-MONGO_URL = os.environ.get("MONGO_URL")
+CHIPS_LAYOUT = os.environ.get("CHIPS_LAYOUT") or "documents"
+# "parquet": read chips and daily prices from parquet_mirror.py instead of STORAGE_BACKEND
+STOCK_BACKEND = os.environ.get("STOCK_BACKEND") or "mongo"
 #  TPE_TIMEZONE = pytz.timezone("Asia/Taipei")
 
 
-mongo_client = MongoClient(MONGO_URL, tz_aware=True)
-db = mongo_client.get_default_database()
-
 SIX_MONTH = 6
 
 
@@ -160,17 +162,34 @@ def draw_chips_trend(stock):
 
 
 if __name__ == "__main__":
+    repository = get_repository(tz_aware=True)
+
     stock_id = get_stock_id()
+    branch_registry = BranchRegistry(repository)
+    mirror = ParquetMirror() if STOCK_BACKEND == "parquet" else None
 
     if stock_id == "all":
-        existed_stocks = db["stocks"].find({"shouldSkip": False}, sort=[("stockId", 1)])
-
-        for stock in existed_stocks:
-            stock = Stock(db, stock["stockId"])
+        existed_stocks = repository.find_stocks(should_skip=False)
+
+        if mirror or CHIPS_LAYOUT in ["buckets", "positions"]:
+            stocks = (
+                Stock(
+                    repository, stock["stockId"], CHIPS_LAYOUT, branch_registry, mirror
+                )
+                for stock in existed_stocks
+            )
+        else:
+            # chips and prices of a chunk of stocks in one query each
+            months_before = datetime.now() - relativedelta(months=SIX_MONTH)
+            stocks = StockBatchLoader(repository, months_before).iter_stocks(
+                existed_stocks, CHIPS_LAYOUT, branch_registry
+            )
+
+        for stock in stocks:
             draw_chips_trend(stock)
     else:
         while True:
-            stock = Stock(db, stock_id)
+            stock = Stock(repository, stock_id, CHIPS_LAYOUT, branch_registry, mirror)
             draw_chips_trend(stock)
 
             stock_id = get_stock_id()
@@ -0,0 +1,309 @@
+import os
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from dotenv import load_dotenv
+
+from branch_registry import BranchRegistry, branch_id_column
+from trades_frame import to_naive_utc, pivot_daily_trades, load_daily_trades_df
+
+load_dotenv()
+
+MONGO_URL = os.environ.get("MONGO_URL")
+
+date_column = "日期"
+chips_collection = "chips"
+buckets_collection = "chips_buckets"
+
+# bucket column: chip row key
+amount_columns = {
+    "buy": "買張",
+    "sell": "賣張",
+    "buyAmount": "買金額",
+    "sellAmount": "賣金額",
+}
+
+# one document per stock-month:
+# {
+#     stockId, month,
+#     dates: [date of each day in this month],
+#     day: [index of dates for each row],
+#     branch: [branch id of BranchRegistry for each row],
+#     buy, sell, buyAmount, sellAmount: [int for each row],
+# }
+
+
+def get_month(date):
+    return datetime(date.year, date.month, 1)
+
+
+def encode_bucket(stock_id, month, chips, branch_registry):
+    chips = sorted(chips, key=lambda chip: chip[date_column])
+
+    bucket = {
+        "stockId": stock_id,
+        "month": month,
+        "dates": [],
+        "day": [],
+        "branch": [],
+        **{column: [] for column in amount_columns},
+    }
+
+    for day, chip in enumerate(chips):
+        bucket["dates"].append(chip[date_column])
+
+        for row in chip["data"]:
+            bucket["day"].append(day)
+            bucket["branch"].append(branch_registry.get_row_id(row))
+
+            for column, key in amount_columns.items():
+                bucket[column].append(row[key])
+
+    return bucket
+
+
+def get_bucket_branch_ids(bucket, branch_registry):
+    # buckets written before BranchRegistry keep their own branch dictionary
+    if "branchCodes" in bucket:
+        local_ids = [
+            branch_registry.get_id(code, name)
+            for code, name in zip(bucket["branchCodes"], bucket["branchNames"])
+        ]
+
+        return [local_ids[branch] for branch in bucket["branch"]]
+
+    return bucket["branch"]
+
+
+def decode_bucket(bucket, branch_registry):
+    chips = [
+        {"stockId": bucket["stockId"], date_column: date, "data": []}
+        for date in bucket["dates"]
+    ]
+
+    branch_ids = get_bucket_branch_ids(bucket, branch_registry)
+
+    for idx, (day, branch_id) in enumerate(zip(bucket["day"], branch_ids)):
+        chips[day]["data"].append(
+            {
+                branch_id_column: branch_id,
+                **{key: bucket[column][idx] for column, key in amount_columns.items()},
+            }
+        )
+
+    return chips
+
+
+def add_chips_to_buckets(db, chips, branch_registry):
+    # same as `$setOnInsert`, days already in bucket are kept
+    month_chips = {}
+
+    for chip in chips:
+        key = (chip["stockId"], get_month(chip[date_column]))
+        month_chips.setdefault(key, []).append(chip)
+
+    for (stock_id, month), new_chips in month_chips.items():
+        bucket = db[buckets_collection].find_one({"stockId": stock_id, "month": month})
+
+        existed_chips = decode_bucket(bucket, branch_registry) if bucket else []
+        existed_dates = {chip[date_column] for chip in existed_chips}
+
+        new_chips = [
+            chip for chip in new_chips if chip[date_column] not in existed_dates
+        ]
+
+        if not new_chips:
+            continue
+
+        bucket = encode_bucket(
+            stock_id, month, existed_chips + new_chips, branch_registry
+        )
+        bucket["createdAt"] = max(chip.get("createdAt", month) for chip in new_chips)
+
+        db[buckets_collection].replace_one(
+            {"stockId": stock_id, "month": month}, bucket, upsert=True
+        )
+
+
+def find_latest_date(db, stock_id):
+    # dates of a bucket are sorted, see encode_bucket
+    bucket = db[buckets_collection].find_one(
+        {"stockId": stock_id}, {"_id": 0, "dates": 1}, sort=[("month", DESCENDING)]
+    )
+
+    if not bucket:
+        raise ValueError(stock_id, "no chips bucket of stock")
+
+    return bucket["dates"][-1]
+
+
+def get_daily_trades_df(db, stock_id, chips_since_date, branch_registry):
+    # columns are branch ids, see BranchRegistry.get_name
+    buckets = db[buckets_collection].find(
+        {"stockId": stock_id, "month": {"$gte": get_month(chips_since_date)}},
+        {
+            "_id": 0,
+            "dates": 1,
+            "day": 1,
+            "branch": 1,
+            "branchCodes": 1,
+            "branchNames": 1,
+            "buy": 1,
+            "sell": 1,
+        },
+        sort=[("month", ASCENDING)],
+    )
+
+    since_date = to_naive_utc(chips_since_date)
+
+    chip_dates = []
+    dates = []
+    branches = []
+    nets = []
+
+    for bucket in buckets:
+        bucket_dates = np.array([date.date() for date in bucket["dates"]], dtype=object)
+        day = np.array(bucket["day"], dtype=np.int64)
+        branch = np.array(
+            get_bucket_branch_ids(bucket, branch_registry), dtype=np.int64
+        )
+        net = np.array(bucket["buy"], dtype=np.int64) - np.array(
+            bucket["sell"], dtype=np.int64
+        )
+
+        # drop days of the first month before chips_since_date
+        keep_dates = np.array(
+            [to_naive_utc(date) >= since_date for date in bucket["dates"]], dtype=bool
+        )
+        keep = keep_dates[day]
+
+        chip_dates.append(bucket_dates[keep_dates])
+        dates.append(bucket_dates[day[keep]])
+        branches.append(branch[keep])
+        nets.append(net[keep])
+
+    if not dates:
+        return pd.DataFrame()
+
+    trades_df = pd.DataFrame(
+        {
+            "date": np.concatenate(dates),
+            "branch": np.concatenate(branches),
+            "net": np.concatenate(nets),
+        }
+    )
+
+    return pivot_daily_trades(trades_df, np.concatenate(chip_dates))
+
+
+def is_reproduced_by_buckets(db, stock_id, chips, branch_registry):
+    # get_daily_trades_df of buckets has every chips day with the same nets,
+    # days only in buckets are not compared
+    chips_df = load_daily_trades_df([chips], branch_registry.find_row_id).fillna(0)
+    buckets_df = get_daily_trades_df(
+        db, stock_id, chips[0][date_column], branch_registry
+    )
+
+    if chips_df.empty or buckets_df.empty:
+        return chips_df.empty and buckets_df.empty
+
+    if not chips_df.index.isin(buckets_df.index).all():
+        return False
+
+    buckets_df = buckets_df.loc[chips_df.index].fillna(0)
+    buckets_df = buckets_df.loc[:, (buckets_df != 0).any()]
+
+    if not buckets_df.columns.isin(chips_df.columns).all():
+        return False
+
+    buckets_df = buckets_df.reindex(columns=chips_df.columns, fill_value=0)
+
+    return np.array_equal(buckets_df.to_numpy(), chips_df.to_numpy())
+
+
+def delete_migrated_chips(db, stock_id, chips, branch_registry):
+    if not is_reproduced_by_buckets(db, stock_id, chips, branch_registry):
+        print(f"stock id: {stock_id}, buckets differ from chips, chips are kept")
+        return 0
+
+    result = db[chips_collection].delete_many(
+        {"stockId": stock_id, date_column: {"$lte": chips[-1][date_column]}}
+    )
+
+    return result.deleted_count
+
+
+def migrate(db, stock_ids):
+    # chips documents of a stock are deleted once its buckets reproduce them
+    branch_registry = BranchRegistry(db)
+
+    for stock_id in stock_ids:
+        print(f"stock id: {stock_id}")
+
+        chips = list(
+            db[chips_collection].find(
+                {"stockId": stock_id}, {"_id": 0}, sort=[(date_column, ASCENDING)]
+            )
+        )
+
+        if not chips:
+            continue
+
+        month_chips = []
+
+        for chip in chips:
+            if month_chips and get_month(chip[date_column]) != get_month(
+                month_chips[0][date_column]
+            ):
+                add_chips_to_buckets(db, month_chips, branch_registry)
+                month_chips = []
+
+            month_chips.append(chip)
+
+        if month_chips:
+            add_chips_to_buckets(db, month_chips, branch_registry)
+
+        deleted_count = delete_migrated_chips(db, stock_id, chips, branch_registry)
+        print(f"delete {deleted_count} chips")
+
+
+def print_storage_stats(db):
+    for collection in [chips_collection, buckets_collection]:
+        stats = db.command("collStats", collection)
+        print(
+            f"{collection}: {stats['count']} documents, "
+            f"size {stats['size'] / 1024 / 1024:.2f} MB, "
+            f"storage {stats['storageSize'] / 1024 / 1024:.2f} MB"
+        )
+
+
+def main():
+    mongo_client = MongoClient(MONGO_URL)
+    db = mongo_client.get_default_database()
+
+    db[buckets_collection].create_index(
+        [("stockId", ASCENDING), ("month", ASCENDING)], unique=True
+    )
+
+    stock_id = sys.argv[1] if len(sys.argv) > 1 else input("input stock id or 'all': ")
+
+    if stock_id == "all":
+        stock_ids = db[chips_collection].distinct("stockId")
+    else:
+        stock_ids = [stock_id]
+
+    print("before migration")
+    print_storage_stats(db)
+
+    migrate(db, sorted(stock_ids))
+
+    print("after migration")
+    print_storage_stats(db)
+
+    mongo_client.close()
+
+
+if __name__ == "__main__":
+    main()
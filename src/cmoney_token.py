@@ -0,0 +1,102 @@
+import os
+import json
+import threading
+import time
+from dotenv import load_dotenv
+
+from http_client import get_session
+
+load_dotenv()
+
+CMONEY_ACCOUNT = os.environ.get("CMONEY_ACCOUNT")
+CMONEY_HASHED_PASSWORD = os.environ.get("CMONEY_HASHED_PASSWORD")
+# keep token on disk between runs if set, e.g. .cmoney_token.json
+CMONEY_TOKEN_CACHE = os.environ.get("CMONEY_TOKEN_CACHE")
+
+# used when token response does not tell its lifetime
+DEFAULT_EXPIRES_IN = 3600
+# refresh token a bit before it really expires
+EXPIRE_MARGIN = 60
+
+
+class CmoneyTokenStore:
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self.access_token = None
+        self.expires_at = 0
+        self.login_count = 0
+        self.lock = threading.Lock()
+
+        self.load()
+
+    def get(self):
+        with self.lock:
+            if not self.is_valid():
+                self.login()
+
+            return self.access_token
+
+    def refresh(self, expired_token):
+        with self.lock:
+            # another thread may already refresh it after the same 401
+            if self.access_token == expired_token or not self.is_valid():
+                self.login()
+
+            return self.access_token
+
+    def is_valid(self):
+        return bool(self.access_token) and time.time() < self.expires_at - EXPIRE_MARGIN
+
+    def login(self):
+        access_token_url = "https://api.cmoney.tw/identity/token"
+
+        data = {
+            "account": CMONEY_ACCOUNT,
+            "hashed_password": CMONEY_HASHED_PASSWORD,
+            "grant_type": "password",
+            "client_id": "cmchipkmobile",
+            "login_method": "email",
+        }
+
+        res = get_session().post(access_token_url, data=data)
+
+        token_info = json.loads(res.text)
+
+        self.access_token = token_info["access_token"]
+        self.expires_at = time.time() + int(
+            token_info.get("expires_in") or DEFAULT_EXPIRES_IN
+        )
+        self.login_count += 1
+
+        print(f"login cmoney, token expires at {time.ctime(self.expires_at)}")
+
+        self.save()
+
+    def load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+
+        try:
+            with open(self.cache_path) as f:
+                token_info = json.load(f)
+
+            self.access_token = token_info["access_token"]
+            self.expires_at = token_info["expires_at"]
+        except (ValueError, KeyError) as e:
+            print(f"ignore broken cmoney token cache {self.cache_path}, ", e)
+
+    def save(self):
+        if not self.cache_path:
+            return
+
+        tmp_path = f"{self.cache_path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"access_token": self.access_token, "expires_at": self.expires_at}, f
+            )
+
+        os.replace(tmp_path, self.cache_path)
+
+
+token_store = CmoneyTokenStore(CMONEY_TOKEN_CACHE)
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+from quarter_price import get_report_deadline, PRICE_WINDOW_DAYS
+from trades_frame import to_naive_utc
+
+TRADING_DAYS = 252
+# rebalance on every quarter report
+REBALANCES_PER_YEAR = 4
+
+date_column = "日期"
+
+
+def iter_periods(trades_df):
+    # one period per rebalance: trades bought on the same quarter and sold on the same quarter
+    for (buy_quarter, sell_quarter), period_df in trades_df.groupby(
+        ["buy_quarter", "sell_quarter"], sort=True
+    ):
+        yield buy_quarter, sell_quarter, period_df
+
+
+def get_buy_date(dates, buy_deadline):
+    # first close after report deadline of any stock, buy price of quarter_price.py,
+    # None if none of them has a price within the window
+    buy_dates = dates[dates > buy_deadline]
+
+    if not len(buy_dates):
+        return None
+
+    buy_date = buy_dates[0]
+
+    if buy_date >= buy_deadline + timedelta(days=PRICE_WINDOW_DAYS):
+        return None
+
+    return buy_date
+
+
+def get_period_equity(repository, buy_quarter, sell_quarter, period_df):
+    # daily value of holdings after the buy day until the sell day,
+    # buy and sell day are the first close after report deadline as in quarter_price.py,
+    # one daily prices query and one pivot per period
+    buy_deadline = get_report_deadline(buy_quarter)
+    sell_deadline = get_report_deadline(sell_quarter)
+    until_date = sell_deadline + timedelta(days=PRICE_WINDOW_DAYS)
+
+    stock_ids = list(pd.unique(period_df["stock_id"]))
+
+    prices = repository.find_stocks_daily_prices(stock_ids, buy_deadline, until_date)
+
+    prices_df = pd.DataFrame(
+        {
+            "date": [to_naive_utc(price[date_column]) for price in prices],
+            "stockId": [price["stockId"] for price in prices],
+            "price": np.array([price["收盤價"] for price in prices], np.float64),
+        }
+    )
+
+    if prices_df.empty:
+        return pd.Series(dtype=np.float64)
+
+    daily_prices_df = prices_df.pivot_table(
+        index="date", columns="stockId", values="price", aggfunc="last"
+    ).reindex(columns=stock_ids)
+
+    buy_date = get_buy_date(daily_prices_df.index, buy_deadline)
+
+    if buy_date is None:
+        return pd.Series(dtype=np.float64)
+
+    # closes before the buy day are not carried into the period
+    daily_prices_df = daily_prices_df[daily_prices_df.index >= buy_date]
+
+    # same stock may be bought twice in a period
+    stock_trades = period_df.groupby("stock_id", sort=False)
+    units = stock_trades["buy_unit"].sum().reindex(stock_ids)
+    buy_prices = stock_trades["buy_price"].first().reindex(stock_ids)
+
+    # days before first close or after stock disappeared keep buy price or last close
+    daily_prices_df = daily_prices_df.ffill().fillna(buy_prices)
+
+    dates = daily_prices_df.index
+    sell_dates = dates[dates > sell_deadline]
+    sell_date = sell_dates[0] if len(sell_dates) else dates[-1]
+
+    # buy day is the sell day of last period
+    daily_prices_df = daily_prices_df[(dates > buy_date) & (dates <= sell_date)]
+
+    return pd.Series(
+        daily_prices_df.to_numpy() @ units.to_numpy(), index=daily_prices_df.index
+    )
+
+
+class RiskStats:
+    # Sharpe and max drawdown of an equity curve given chunk by chunk
+    def __init__(self, init_money):
+        self.last_equity = init_money
+        self.peak = init_money
+        self.max_drawdown = 0.0
+        self.return_count = 0
+        self.return_sum = 0.0
+        self.return_square_sum = 0.0
+
+    def update(self, equity):
+        equity = np.asarray(equity, np.float64)
+
+        if not len(equity):
+            return
+
+        returns = np.diff(np.append(self.last_equity, equity)) / np.append(
+            self.last_equity, equity[:-1]
+        )
+        self.return_count += len(returns)
+        self.return_sum += returns.sum()
+        self.return_square_sum += np.square(returns).sum()
+
+        peaks = np.maximum.accumulate(np.append(self.peak, equity))[1:]
+        self.max_drawdown = min(self.max_drawdown, float((equity / peaks - 1).min()))
+
+        self.peak = peaks[-1]
+        self.last_equity = equity[-1]
+
+    @property
+    def sharpe(self):
+        # annualized, risk free rate 0
+        if self.return_count < 2:
+            return 0.0
+
+        mean = self.return_sum / self.return_count
+        variance = (self.return_square_sum - self.return_count * mean**2) / (
+            self.return_count - 1
+        )
+
+        if variance <= 0:
+            return 0.0
+
+        return float(mean / np.sqrt(variance) * np.sqrt(TRADING_DAYS))
+
+
+def get_turnovers(trades_df):
+    # half of the absolute weight change on each rebalance,
+    # weights before are at sell price and weights after are at buy price
+    turnovers = {}
+    last_weights = pd.Series(dtype=np.float64)
+
+    for buy_quarter, _, period_df in iter_periods(trades_df):
+        values = (
+            (period_df["buy_unit"] * period_df["buy_price"])
+            .groupby(period_df["stock_id"])
+            .sum()
+        )
+        weights = values / values.sum()
+
+        turnovers[buy_quarter] = float(
+            weights.sub(last_weights, fill_value=0).abs().sum() / 2
+        )
+
+        sell_prices = period_df["sell_price"].where(
+            period_df["sell_price"] != -1, period_df["buy_price"]
+        )
+        sell_values = (
+            (period_df["buy_unit"] * sell_prices).groupby(period_df["stock_id"]).sum()
+        )
+        last_weights = sell_values / sell_values.sum()
+
+    return pd.Series(turnovers, dtype=np.float64)
+
+
+def iter_equity_curve(repository, trade_ledger):
+    # one chunk of daily equity per rebalance period, only one period is in memory
+    trades_df = trade_ledger.to_df()
+
+    for buy_quarter, sell_quarter, period_df in iter_periods(trades_df):
+        equity = get_period_equity(repository, buy_quarter, sell_quarter, period_df)
+
+        yield buy_quarter, sell_quarter, equity
+
+
+def get_risk_report(repository, portfolio, init_money, keep_curve=False):
+    # keep_curve: also return the whole daily equity Series
+    stats = RiskStats(init_money)
+    curve = []
+
+    for _, _, equity in iter_equity_curve(repository, portfolio.trade_history):
+        stats.update(equity)
+
+        if keep_curve:
+            curve.append(equity)
+
+    turnovers = get_turnovers(portfolio.trade_history.to_df())
+
+    report = {
+        "sharpe": round(stats.sharpe, 4),
+        "maxDrawdown": round(stats.max_drawdown, 4),
+        "turnover": round(float(turnovers.mean()), 4) if len(turnovers) else 0.0,
+        "annualTurnover": (
+            round(float(turnovers.mean()) * REBALANCES_PER_YEAR, 4)
+            if len(turnovers)
+            else 0.0
+        ),
+    }
+
+    if keep_curve:
+        report["curve"] = pd.concat(curve) if curve else pd.Series(dtype=np.float64)
+
+    return report
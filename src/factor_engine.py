@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+
+from quarter_price import find_quarter_prices_df
+from price_index import MISSING_PRICE
+
+quarter_column = "會計年季度"
+
+# fields of stock_infos_quarter used by the factors, missing field is NaN
+info_columns = [
+    "普通股股本",
+    "毛利",
+    "營業利益",
+    "稅後淨利",
+    "母公司業主淨利",
+    "折舊",
+    "攤銷",
+    "總負債",
+    "現金及約當現金",
+    "短期投資",
+]
+
+# ratios and QOQ growth already computed by StockCrawler.get_year_report, kept as they are
+ratio_columns = [
+    "每股淨值",
+    "單季EPS",
+    "ROE",
+    "ROA",
+    "單季營收季增率",
+    "毛利率",
+    "單季毛利季增率",
+    "營業利益率",
+    "單季營業利益季增率",
+    "稅前淨利率",
+    "稅後淨利率",
+    "單季稅後淨利季增率",
+    "單季EPS季增率",
+]
+
+
+def load_infos_df(repository, quarters, candidates_only=False):
+    # one row per (quarter, stock) in the order the repository returns them,
+    # candidates_only filters EBITDA candidates in the query
+    if candidates_only:
+        infos = repository.find_EBITDA_candidate_infos(quarters)
+    else:
+        infos = repository.find_infos_of_quarters(quarters)
+
+    infos_df = pd.DataFrame(
+        {
+            "stockId": [info["stockId"] for info in infos],
+            quarter_column: [info[quarter_column] for info in infos],
+            "isTop200Company": [info.get("isTop200Company") is True for info in infos],
+            **{
+                column: np.array(
+                    [info.get(column, np.nan) for info in infos], np.float64
+                )
+                for column in info_columns + ratio_columns
+            },
+        }
+    )
+
+    # keep order of quarters, then order of documents
+    quarter_order = {quarter: idx for idx, quarter in enumerate(quarters)}
+
+    return infos_df.sort_values(
+        quarter_column, key=lambda column: column.map(quarter_order), kind="stable"
+    ).reset_index(drop=True)
+
+
+def get_EBITDA_candidates(infos_df):
+    # same as repository EBITDA_candidate_query: not top 200 company,
+    # with 普通股股本 and non-zero 毛利 and 營業利益
+    return (
+        ~infos_df["isTop200Company"]
+        & (infos_df["普通股股本"].fillna(0) > 0)
+        & (infos_df["毛利"] != 0)
+        & (infos_df["營業利益"] != 0)
+    )
+
+
+def get_EBITDA(infos_df):
+    # same as StockQuarter.EBITDA
+    is_wrong_info = (
+        (infos_df["毛利"] == 0)
+        | (infos_df["營業利益"] == 0)
+        | (infos_df["稅後淨利"] == 0)
+        | (infos_df["母公司業主淨利"] == 0)
+    )
+
+    EBITDA = infos_df["營業利益"] + infos_df["折舊"] + infos_df["攤銷"]
+
+    return EBITDA.where(~is_wrong_info, 0)
+
+
+def get_EV(infos_df, prices):
+    # same as StockQuarter.EV, prices of missing price are MISSING_PRICE,
+    # NaN price (not looked up) gives 0 as well
+    market_value = np.trunc(prices * infos_df["普通股股本"])
+
+    EV = market_value + infos_df["總負債"] - infos_df["現金及約當現金"] - infos_df["短期投資"]
+
+    return EV.where(market_value > 0, 0)
+
+
+def get_EBITDA_mod_EV(EBITDA, EV):
+    # same as StockQuarter.EBITDA_mod_EV
+    is_valid = (EBITDA != 0) & (EV > 0)
+
+    EBITDA_mod_EV = (EBITDA * 100 / EV.where(is_valid, 1)).round(4)
+
+    return EBITDA_mod_EV.where(is_valid, 0)
+
+
+def find_prices(repository, infos_df, price_index=None):
+    # price after quarter report of every row: prices_quarter in one read,
+    # then the first daily close after deadline for the rest,
+    # also returns which rows are not in prices_quarter
+    prices = {
+        (price_quarter["stockId"], price_quarter[quarter_column]): price_quarter[
+            "price"
+        ]
+        for price_quarter in repository.find_quarter_prices(
+            list(pd.unique(infos_df[quarter_column]))
+        )
+    }
+
+    keys = list(zip(infos_df["stockId"], infos_df[quarter_column]))
+    missing_keys = [key for key in keys if key not in prices]
+
+    if missing_keys:
+        daily_prices_df = find_quarter_prices_df(repository, missing_keys)
+
+        for stock_id, quarter, price in zip(
+            daily_prices_df["stockId"],
+            daily_prices_df[quarter_column],
+            daily_prices_df["收盤價"].tolist(),
+        ):
+            if pd.isna(price):
+                print(f"stock_id: {stock_id}, quarter: {quarter}, can not find price")
+                price = MISSING_PRICE
+
+            prices[(stock_id, quarter)] = price
+
+    if price_index is not None:
+        for (stock_id, quarter), price in prices.items():
+            price_index.put(stock_id, quarter, price)
+
+    missing_keys = set(missing_keys)
+
+    return (
+        pd.Series(
+            [prices[key] for key in keys], index=infos_df.index, dtype=np.float64
+        ),
+        pd.Series([key in missing_keys for key in keys], index=infos_df.index),
+    )
+
+
+def get_factor_df(repository, quarters, price_index=None, candidates_only=False):
+    # one row per (quarter, stock) with EBITDA, EV, EBITDA_mod_EV and the ratio columns,
+    # EBITDA_mod_EV is 0 for stocks which are not EBITDA candidates,
+    # isPriceFromDaily: price is from dailyPrices or missing, see FactorStore.refresh
+    infos_df = load_infos_df(repository, quarters, candidates_only)
+
+    if candidates_only:
+        infos_df["isEBITDACandidate"] = True
+    else:
+        infos_df["isEBITDACandidate"] = get_EBITDA_candidates(infos_df)
+    infos_df["EBITDA"] = get_EBITDA(infos_df)
+
+    # like StockQuarter.EBITDA_mod_EV, price is only needed if EBITDA is not 0
+    need_price = infos_df["isEBITDACandidate"] & (infos_df["EBITDA"] != 0)
+    prices = pd.Series(np.nan, index=infos_df.index, dtype=np.float64)
+    is_price_from_daily = pd.Series(False, index=infos_df.index)
+    if need_price.any():
+        prices[need_price], is_price_from_daily[need_price] = find_prices(
+            repository, infos_df[need_price], price_index
+        )
+
+    infos_df["price"] = prices
+    infos_df["isPriceFromDaily"] = is_price_from_daily
+    infos_df["EV"] = get_EV(infos_df, prices)
+    infos_df["EBITDA_mod_EV"] = get_EBITDA_mod_EV(
+        infos_df["EBITDA"], infos_df["EV"]
+    ).where(infos_df["isEBITDACandidate"], 0)
+
+    return infos_df
+
+
+def get_EBITDA_mod_EV_df(repository, quarters, price_index=None):
+    # one row per candidate (quarter, stock)
+    return get_factor_df(repository, quarters, price_index, candidates_only=True)
+
+
+def get_factor_panel(factor_df, factor_column):
+    # quarter x stock
+    return factor_df.pivot(
+        index=quarter_column, columns="stockId", values=factor_column
+    )
+
+
+def rank_panel(panel, counts):
+    # panel: quarter x stock, counts: list of portfolio size
+    # returns {count: DataFrame of rank x quarter} like stocks_rank_df of EBITDA_strategy,
+    # factor NaN or <= 0 is left out (None), tie goes to the smaller stock id
+    panel = panel.sort_index(axis="columns")
+    values = panel.to_numpy(np.float64)
+    is_valid = values > 0
+
+    # stable sort keeps stock id order of ties, invalid ones go last
+    order = np.argsort(np.where(is_valid, -values, np.inf), axis=1, kind="stable")
+    valid_count = is_valid.sum(axis=1)
+
+    stock_ids = panel.columns.to_numpy(object)
+    max_count = min(max(counts), len(stock_ids))
+    top_stock_ids = stock_ids[order[:, :max_count]]
+    top_stock_ids[np.arange(max_count) >= valid_count[:, None]] = None
+
+    return {
+        count: pd.DataFrame(top_stock_ids[:, :count].T, columns=panel.index)
+        for count in counts
+    }
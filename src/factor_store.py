@@ -0,0 +1,228 @@
+import os
+import json
+from datetime import datetime
+import pandas as pd
+from dotenv import load_dotenv
+
+import factor_engine
+from repository import get_repository
+from trades_frame import to_naive_utc
+
+load_dotenv()
+
+FACTOR_STORE_DIR = os.environ.get("FACTOR_STORE_DIR") or "factors"
+
+quarter_column = "會計年季度"
+factors_file = "factors.parquet"
+watermarks_file = "_watermarks.json"
+
+# bump when factor_engine computes factors differently, the whole store is rebuilt
+FACTOR_VERSION = 2
+
+# a new report or a new price after report changes factors of its (stock, quarter)
+SOURCE_COLLECTIONS = ["stock_infos_quarter", "prices_quarter"]
+# a new daily price of a stock changes factors of the stock with isPriceFromDaily,
+# see factor_engine.find_prices
+DAILY_PRICES_COLLECTION = "dailyPrices"
+
+
+class FactorStore:
+    # factor_engine.get_factor_df of every quarter, one row per (quarter, stock)
+    def __init__(self, root=FACTOR_STORE_DIR):
+        self.root = root
+
+    def read_watermarks_file(self):
+        # None if nothing stored yet or stored by another FACTOR_VERSION
+        path = os.path.join(self.root, watermarks_file)
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as f:
+            watermarks = json.load(f)
+
+        if watermarks.get("version") != FACTOR_VERSION:
+            return None
+
+        return watermarks
+
+    def get_watermarks(self):
+        watermarks = self.read_watermarks_file()
+
+        if watermarks is None:
+            return None
+
+        return {
+            collection: datetime.fromisoformat(watermark)
+            for collection, watermark in watermarks["collections"].items()
+        }
+
+    def get_watermark_keys(self):
+        # (stockId, 會計年季度) of documents created at the watermark, already computed,
+        # (stockId,) for DAILY_PRICES_COLLECTION
+        watermarks = self.read_watermarks_file()
+
+        if watermarks is None:
+            return {}
+
+        return {
+            collection: {tuple(key) for key in keys}
+            for collection, keys in watermarks.get("watermarkKeys", {}).items()
+        }
+
+    def save_watermarks(self, watermarks, watermark_keys):
+        with open(os.path.join(self.root, watermarks_file), "w") as f:
+            json.dump(
+                {
+                    "version": FACTOR_VERSION,
+                    "collections": {
+                        collection: watermark.isoformat()
+                        for collection, watermark in watermarks.items()
+                    },
+                    "watermarkKeys": {
+                        collection: sorted(keys)
+                        for collection, keys in watermark_keys.items()
+                    },
+                },
+                f,
+                ensure_ascii=False,
+            )
+
+    def load(self):
+        path = os.path.join(self.root, factors_file)
+
+        if self.get_watermarks() is None or not os.path.exists(path):
+            return pd.DataFrame()
+
+        return pd.read_parquet(path)
+
+    def save(self, factors_df):
+        path = os.path.join(self.root, factors_file)
+
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        factors_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def refresh(self, repository, price_index=None):
+        # only recompute (stock, quarter) created since last refresh,
+        # documents of one crawl share createdAt, so documents at the watermark are read again
+        # and only the ones not computed yet are new
+        factors_df = self.load()
+        watermarks = {} if factors_df.empty else self.get_watermarks()
+        watermark_keys = {} if factors_df.empty else self.get_watermark_keys()
+
+        changed_keys = set()
+        changed_stock_ids = set()
+        new_watermarks = dict(watermarks)
+        new_watermark_keys = dict(watermark_keys)
+
+        for collection in SOURCE_COLLECTIONS + [DAILY_PRICES_COLLECTION]:
+            watermark = watermarks.get(collection)
+            computed_keys = watermark_keys.get(collection, set())
+
+            if collection == DAILY_PRICES_COLLECTION and factors_df.empty:
+                # every factor is computed anyway, only the latest crawl is a watermark
+                max_created_at = repository.find_max_created_at(collection)
+                docs = (
+                    repository.find_created_since(collection, max_created_at)
+                    if max_created_at
+                    else []
+                )
+            else:
+                docs = repository.find_created_since(collection, watermark)
+
+            if collection == DAILY_PRICES_COLLECTION:
+                # daily prices crawled before createdAt existed are never new
+                docs = [doc for doc in docs if doc.get("createdAt")]
+
+            created_ats = [
+                to_naive_utc(doc["createdAt"]) if doc.get("createdAt") else None
+                for doc in docs
+            ]
+
+            if collection == DAILY_PRICES_COLLECTION:
+                keys = [(doc["stockId"],) for doc in docs]
+            else:
+                keys = [(doc["stockId"], doc[quarter_column]) for doc in docs]
+
+            collection_changed_keys = {
+                key
+                for key, created_at in zip(keys, created_ats)
+                if not (watermark and created_at == watermark and key in computed_keys)
+            }
+
+            if collection == DAILY_PRICES_COLLECTION:
+                changed_stock_ids.update(key[0] for key in collection_changed_keys)
+            else:
+                changed_keys.update(collection_changed_keys)
+
+            new_watermark = max(filter(None, [watermark, *created_ats]), default=None)
+            if new_watermark:
+                new_watermarks[collection] = new_watermark
+                new_watermark_keys[collection] = {
+                    key
+                    for key, created_at in zip(keys, created_ats)
+                    if created_at == new_watermark
+                }
+
+        if changed_stock_ids and not factors_df.empty:
+            is_changed_stock = factors_df["stockId"].isin(changed_stock_ids)
+            is_changed_price = factors_df["isPriceFromDaily"] & is_changed_stock
+
+            changed_keys.update(
+                zip(
+                    factors_df.loc[is_changed_price, "stockId"],
+                    factors_df.loc[is_changed_price, quarter_column],
+                )
+            )
+
+        if not changed_keys:
+            # new daily prices changed no factor, they are not read again next time
+            if new_watermarks != watermarks and not factors_df.empty:
+                self.save_watermarks(new_watermarks, new_watermark_keys)
+
+            print("factor store is up to date")
+            return factors_df
+
+        quarters = sorted({quarter for _, quarter in changed_keys})
+        print(f"recompute {len(changed_keys)} factors of {len(quarters)} quarters")
+
+        new_factors_df = factor_engine.get_factor_df(repository, quarters, price_index)
+
+        new_keys = pd.MultiIndex.from_frame(new_factors_df[["stockId", quarter_column]])
+        new_factors_df = new_factors_df[new_keys.isin(list(changed_keys))]
+
+        if not factors_df.empty:
+            keys = pd.MultiIndex.from_frame(factors_df[["stockId", quarter_column]])
+            factors_df = factors_df[~keys.isin(list(changed_keys))]
+
+        factors_dfs = [df for df in [factors_df, new_factors_df] if not df.empty]
+        if not factors_dfs:
+            return pd.DataFrame()
+
+        factors_df = pd.concat(factors_dfs, ignore_index=True)
+        factors_df = factors_df.sort_values(
+            [quarter_column, "stockId"], kind="stable", ignore_index=True
+        )
+
+        self.save(factors_df)
+        self.save_watermarks(new_watermarks, new_watermark_keys)
+
+        return factors_df
+
+    def get_factor_panel(self, factor_column):
+        return factor_engine.get_factor_panel(self.load(), factor_column)
+
+
+def main():
+    repository = get_repository()
+
+    factors_df = FactorStore().refresh(repository)
+    print(f"{len(factors_df)} factors in store")
+
+    repository.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,5 @@
 import os
-import requests
 import time
-from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from urllib.parse import quote
 from datetime import datetime
@@ -9,6 +7,8 @@ from dateutil.rrule import rrule, DAILY
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from http_client import get_session, print_connection_stats
+
 load_dotenv()
 
 MONGO_URL = os.environ.get("MONGO_URL")
@@ -58,11 +58,7 @@ def get_response(date):
 
     retry_time = 0
     while retry_time < 10:
-        session = requests.Session()
-        adapter = HTTPAdapter(max_retries=5)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        res = session.post(url, data=data)
+        res = get_session().post(url, data=data)
 
         if "overrun" not in res.text.lower():
             return res
@@ -158,4 +154,6 @@ for date in dates:
 
     time.sleep(3)
 
+print_connection_stats()
+
 mongo_client.close()
@@ -0,0 +1,77 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# connections kept alive for each host, should not be less than CHIPS_CONCURRENCY
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE") or 16)
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES") or 5)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+
+    if _session:
+        return _session
+
+    with _session_lock:
+        if not _session:
+            session = requests.Session()
+            # pool_block: wait for an idle connection instead of opening an extra one,
+            # so each host never gets more than HTTP_POOL_MAXSIZE connections
+            adapter = HTTPAdapter(
+                pool_connections=8,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                pool_block=True,
+                max_retries=HTTP_MAX_RETRIES,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            _session = session
+
+    return _session
+
+
+def get_connection_stats():
+    if not _session:
+        return {}
+
+    stats = {}
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+
+        for key in pools.keys():
+            pool = pools[key]
+
+            if not pool:
+                continue
+
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            requests_count = pool.num_requests
+            connections_count = pool.num_connections
+
+            stats[host] = {
+                "requests": requests_count,
+                "connections": connections_count,
+                "reused": max(requests_count - connections_count, 0),
+            }
+
+    return stats
+
+
+def print_connection_stats():
+    for host, stat in get_connection_stats().items():
+        reuse_rate = stat["reused"] / stat["requests"] if stat["requests"] else 0
+
+        print(
+            f"{host}: {stat['requests']} requests, {stat['connections']} connections, "
+            f"reuse rate: {reuse_rate * 100:.2f} %"
+        )
@@ -0,0 +1,174 @@
+import os
+import sys
+from datetime import datetime
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGO_URL = os.environ.get("MONGO_URL")
+
+# collection: list of (keys, options)
+INDEXES = {
+    "stocks": [
+        ([("stockId", ASCENDING)], {}),
+        ([("shouldSkip", ASCENDING), ("stockId", ASCENDING)], {}),
+    ],
+    "branches": [
+        ([("code", ASCENDING)], {"unique": True}),
+        ([("branchId", ASCENDING)], {"unique": True}),
+    ],
+    "chips": [
+        ([("stockId", ASCENDING), ("日期", DESCENDING)], {}),
+    ],
+    "chips_buckets": [
+        ([("stockId", ASCENDING), ("month", ASCENDING)], {"unique": True}),
+    ],
+    "branch_positions": [
+        ([("stockId", ASCENDING), ("日期", DESCENDING)], {"unique": True}),
+    ],
+    "dailyPrices": [
+        ([("stockId", ASCENDING), ("日期", DESCENDING)], {}),
+        # TradingCalendar distinct dates
+        ([("日期", ASCENDING)], {}),
+        # data watermark of backtest_cache.py
+        ([("createdAt", DESCENDING)], {}),
+    ],
+    "stock_infos_quarter": [
+        ([("stockId", ASCENDING), ("會計年季度", ASCENDING)], {}),
+        ([("會計年季度", ASCENDING)], {}),
+        # FactorStore refresh and data watermark
+        ([("createdAt", DESCENDING)], {}),
+    ],
+    "prices_quarter": [
+        ([("stockId", ASCENDING), ("會計年季度", ASCENDING)], {}),
+        ([("createdAt", DESCENDING)], {}),
+    ],
+    "company_daily_messages": [
+        ([("date", ASCENDING), ("time", ASCENDING), ("company_code", ASCENDING)], {}),
+    ],
+}
+
+
+def get_query_shapes(db):
+    sample_stock = db.stocks.find_one({}, sort=[("stockId", ASCENDING)]) or {}
+    stock_id = sample_stock.get("stockId", "2330")
+    date = datetime(2021, 1, 1)
+    quarter = "20211"
+
+    # (name, collection, filter, sort)
+    return [
+        ("stocks by shouldSkip", "stocks", {"shouldSkip": False}, [("stockId", 1)]),
+        ("stock threshold", "stocks", {"stockId": stock_id}, None),
+        ("latest chips", "chips", {"stockId": stock_id}, [("日期", -1)]),
+        (
+            "chips since date",
+            "chips",
+            {"stockId": stock_id, "日期": {"$gte": date}},
+            None,
+        ),
+        (
+            "chips buckets since month",
+            "chips_buckets",
+            {"stockId": stock_id, "month": {"$gte": date}},
+            [("month", 1)],
+        ),
+        (
+            "branch positions before date",
+            "branch_positions",
+            {"stockId": stock_id, "日期": {"$lt": date}},
+            [("日期", -1)],
+        ),
+        ("latest daily price", "dailyPrices", {"stockId": stock_id}, [("日期", -1)]),
+        (
+            "daily prices since date",
+            "dailyPrices",
+            {"stockId": stock_id, "日期": {"$gte": date}},
+            [("日期", 1)],
+        ),
+        ("trading days", "dailyPrices", {"日期": {"$gte": date}}, None),
+        (
+            "stock quarter info",
+            "stock_infos_quarter",
+            {"stockId": stock_id, "會計年季度": quarter},
+            None,
+        ),
+        ("quarter infos", "stock_infos_quarter", {"會計年季度": quarter}, None),
+        (
+            "price quarter",
+            "prices_quarter",
+            {"stockId": stock_id, "會計年季度": quarter},
+            None,
+        ),
+        ("latest message", "company_daily_messages", {}, [("date", -1)]),
+        (
+            "message upsert",
+            "company_daily_messages",
+            {"date": date, "time": "00:00:00", "company_code": stock_id},
+            None,
+        ),
+    ]
+
+
+def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            # create_index is a no-op if the same index already exists
+            name = db[collection].create_index(keys, **options)
+            print(f"{collection}: index {name} ok")
+
+
+def get_plan_stages(plan):
+    stages = [plan.get("stage")]
+
+    if "inputStage" in plan:
+        stages += get_plan_stages(plan["inputStage"])
+
+    for input_plan in plan.get("inputStages", []):
+        stages += get_plan_stages(input_plan)
+
+    # mongo 5+ slot based execution wraps the plan in queryPlan
+    if "queryPlan" in plan:
+        stages += get_plan_stages(plan["queryPlan"])
+
+    return stages
+
+
+def check_indexes(db):
+    collscan_shapes = []
+
+    for name, collection, query, sort in get_query_shapes(db):
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = get_plan_stages(plan)
+
+        if "COLLSCAN" in stages:
+            collscan_shapes.append(name)
+            print(f"COLLSCAN  {name}: {collection} {query} sort={sort}")
+        else:
+            print(f"ok        {name}: {' <- '.join(filter(None, stages))}")
+
+    return collscan_shapes
+
+
+def main():
+    mongo_client = MongoClient(MONGO_URL)
+    db = mongo_client.get_default_database()
+
+    if "--check" not in sys.argv:
+        ensure_indexes(db)
+
+    collscan_shapes = check_indexes(db)
+
+    mongo_client.close()
+
+    if collscan_shapes:
+        print(f"{len(collscan_shapes)} query shapes still do collection scan")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
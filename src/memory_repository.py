@@ -0,0 +1,103 @@
+import threading
+
+from base_repository import Repository, date_column, quarter_column
+from trades_frame import to_naive_utc
+
+
+def match_doc(doc, stock_id, stock_ids, quarter, since_date, after_date, before_date):
+    if stock_id is not None and doc.get("stockId") != stock_id:
+        return False
+
+    if stock_ids is not None and doc.get("stockId") not in stock_ids:
+        return False
+
+    if quarter is not None and doc.get(quarter_column) != quarter:
+        return False
+
+    if since_date or after_date or before_date:
+        if date_column not in doc:
+            return False
+
+        date = to_naive_utc(doc[date_column])
+
+        if since_date and date < to_naive_utc(since_date):
+            return False
+        if after_date and date <= to_naive_utc(after_date):
+            return False
+        if before_date and date >= to_naive_utc(before_date):
+            return False
+
+    return True
+
+
+class MemoryRepository(Repository):
+    # for tests and benchmarks, collections: {collection: [doc]}
+    def __init__(self, collections=None):
+        self.collections = {
+            collection: [dict(doc) for doc in docs]
+            for collection, docs in (collections or {}).items()
+        }
+        self.lock = threading.Lock()
+
+    def find(
+        self,
+        collection,
+        stock_id=None,
+        stock_ids=None,
+        quarter=None,
+        since_date=None,
+        after_date=None,
+        before_date=None,
+        sort=None,
+        limit=None,
+    ):
+        docs = [
+            doc
+            for doc in self.collections.get(collection, [])
+            if match_doc(
+                doc, stock_id, stock_ids, quarter, since_date, after_date, before_date
+            )
+        ]
+
+        if sort:
+            docs = sorted(
+                docs, key=lambda doc: to_naive_utc(doc[date_column]), reverse=sort < 0
+            )
+
+        return [dict(doc) for doc in docs[:limit]]
+
+    def upsert_many(self, collection, docs, key_columns):
+        upserted_count = 0
+
+        with self.lock:
+            stored_docs = self.collections.setdefault(collection, [])
+            stored_keys = {
+                tuple(doc.get(key) for key in key_columns) for doc in stored_docs
+            }
+
+            for doc in docs:
+                key = tuple(doc[key] for key in key_columns)
+
+                if key not in stored_keys:
+                    stored_docs.append(dict(doc))
+                    stored_keys.add(key)
+                    upserted_count += 1
+
+        return upserted_count
+
+    def distinct_dates(self, collection, since_date=None):
+        return sorted(
+            {doc[date_column] for doc in self.find(collection, since_date=since_date)}
+        )
+
+    def delete_many(self, collection, stock_id, since_date):
+        with self.lock:
+            docs = self.collections.get(collection, [])
+            kept_docs = [
+                doc
+                for doc in docs
+                if not match_doc(doc, stock_id, None, None, since_date, None, None)
+            ]
+            self.collections[collection] = kept_docs
+
+        return len(docs) - len(kept_docs)
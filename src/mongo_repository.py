@@ -0,0 +1,260 @@
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+from base_repository import (
+    Repository,
+    LOADER_BATCH_SIZE,
+    date_column,
+    quarter_column,
+    branch_id_column,
+    chips_projection,
+    EBITDA_candidate_query,
+)
+from bulk_writer import BulkUpserter, BULK_BATCH_SIZE
+from trades_frame import to_naive_utc
+
+
+class MongoRepository(Repository):
+    def __init__(self, db, mongo_client=None):
+        self.db = db
+        self.mongo_client = mongo_client
+
+    def get_query(
+        self,
+        stock_id=None,
+        stock_ids=None,
+        quarter=None,
+        since_date=None,
+        after_date=None,
+        before_date=None,
+    ):
+        query = {}
+
+        if stock_id is not None:
+            query["stockId"] = stock_id
+
+        if stock_ids is not None:
+            query["stockId"] = {"$in": list(stock_ids)}
+
+        if quarter is not None:
+            query[quarter_column] = quarter
+
+        date_query = {}
+        if since_date:
+            date_query["$gte"] = since_date
+        if after_date:
+            date_query["$gt"] = after_date
+        if before_date:
+            date_query["$lt"] = before_date
+
+        if date_query:
+            query[date_column] = date_query
+
+        return query
+
+    def find(self, collection, sort=None, limit=None, **kwargs):
+        cursor = self.db[collection].find(self.get_query(**kwargs))
+
+        if sort:
+            cursor = cursor.sort([(date_column, ASCENDING if sort > 0 else DESCENDING)])
+
+        if limit:
+            cursor = cursor.limit(limit)
+
+        return list(cursor)
+
+    def upsert_many(self, collection, docs, key_columns):
+        writer = self.bulk_upserter(collection, key_columns)
+        writer.add_many(docs)
+        writer.flush()
+
+        return writer.upserted_count
+
+    def bulk_upserter(self, collection, key_columns, batch_size=BULK_BATCH_SIZE):
+        return BulkUpserter(self.db[collection], key_columns, batch_size)
+
+    def distinct_dates(self, collection, since_date=None):
+        query = {date_column: {"$gte": since_date}} if since_date else {}
+
+        return self.db[collection].distinct(date_column, query)
+
+    def delete_many(self, collection, stock_id, since_date):
+        result = self.db[collection].delete_many(
+            self.get_query(stock_id=stock_id, since_date=since_date)
+        )
+
+        return result.deleted_count
+
+    def close(self):
+        if self.mongo_client:
+            self.mongo_client.close()
+
+    def find_stocks(self, should_skip=None):
+        query = {} if should_skip is None else {"shouldSkip": should_skip}
+
+        return list(self.db.stocks.find(query, sort=[("stockId", ASCENDING)]))
+
+    def find_infos_of_quarters(self, quarters):
+        return list(
+            self.db.stock_infos_quarter.find(
+                {quarter_column: {"$in": list(quarters)}}, {"_id": 0}
+            )
+        )
+
+    def find_EBITDA_candidate_infos(self, quarters):
+        return list(
+            self.db.stock_infos_quarter.find(
+                {quarter_column: {"$in": list(quarters)}, **EBITDA_candidate_query},
+                {"_id": 0},
+            )
+        )
+
+    def find_quarter_prices(self, quarters):
+        return list(
+            self.db.prices_quarter.find(
+                {quarter_column: {"$in": list(quarters)}},
+                {"_id": 0, "stockId": 1, quarter_column: 1, "price": 1},
+            )
+        )
+
+    def find_created_since(self, collection, created_at=None):
+        query = {"createdAt": {"$gte": created_at}} if created_at else {}
+
+        return list(
+            self.db[collection].find(
+                query, {"_id": 0, "stockId": 1, quarter_column: 1, "createdAt": 1}
+            )
+        )
+
+    def find_max_created_at(self, collection):
+        doc = self.db[collection].find_one(
+            {"createdAt": {"$exists": True}},
+            {"_id": 0, "createdAt": 1},
+            sort=[("createdAt", DESCENDING)],
+        )
+
+        return to_naive_utc(doc["createdAt"]) if doc else None
+
+    def count(self, collection):
+        # from collection metadata, documents of input collections are never deleted
+        return self.db[collection].estimated_document_count()
+
+    def find_daily_prices(self, stock_id, since_date):
+        return list(
+            self.db.dailyPrices.find(
+                {"stockId": stock_id, date_column: {"$gte": since_date}},
+                {"_id": 0, "收盤價": 1, date_column: 1},
+            ).sort([(date_column, ASCENDING)])
+        )
+
+    def iter_batches(self, cursor, batch_size):
+        batch = []
+
+        for doc in cursor.batch_size(batch_size):
+            batch.append(doc)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def iter_chips(self, stock_id, since_date, batch_size=LOADER_BATCH_SIZE):
+        cursor = self.db.chips.find(
+            {"stockId": stock_id, date_column: {"$gte": since_date}}, chips_projection
+        ).sort([(date_column, ASCENDING)])
+
+        return self.iter_batches(cursor, batch_size)
+
+    def iter_daily_prices(self, stock_id, since_date, batch_size=LOADER_BATCH_SIZE):
+        cursor = self.db.dailyPrices.find(
+            {"stockId": stock_id, date_column: {"$gte": since_date}},
+            {"_id": 0, "收盤價": 1, date_column: 1},
+        ).sort([(date_column, ASCENDING)])
+
+        return self.iter_batches(cursor, batch_size)
+
+    def find_stocks_chips(self, stock_ids, since_date):
+        return list(
+            self.db.chips.find(
+                {
+                    "stockId": {"$in": list(stock_ids)},
+                    date_column: {"$gte": since_date},
+                },
+                {**chips_projection, "stockId": 1},
+            )
+        )
+
+    def find_stocks_daily_prices(self, stock_ids, since_date, before_date=None):
+        return list(
+            self.db.dailyPrices.find(
+                self.get_query(
+                    stock_ids=stock_ids, since_date=since_date, before_date=before_date
+                ),
+                {"_id": 0, "stockId": 1, "收盤價": 1, date_column: 1},
+            )
+        )
+
+    def find_daily_branch_nets(self, stock_id, since_date, branches=None):
+        # only the net series of each day comes over the wire
+        branch = {"$ifNull": [f"$$this.{branch_id_column}", "$$this.分點代號"]}
+
+        pipeline = [
+            {"$match": {"stockId": stock_id, date_column: {"$gte": since_date}}},
+            {"$sort": {date_column: 1}},
+        ]
+
+        if branches is not None:
+            pipeline.append(
+                {
+                    "$addFields": {
+                        "data": {
+                            "$filter": {
+                                "input": "$data",
+                                "cond": {"$in": [branch, list(branches)]},
+                            }
+                        }
+                    }
+                }
+            )
+
+        # one document per day, days without rows keep empty arrays
+        pipeline.append(
+            {
+                "$project": {
+                    "_id": f"${date_column}",
+                    "branches": {"$map": {"input": "$data", "in": branch}},
+                    "names": {
+                        "$map": {
+                            "input": "$data",
+                            "in": {"$ifNull": ["$$this.分點名稱", None]},
+                        }
+                    },
+                    "nets": {
+                        "$map": {
+                            "input": "$data",
+                            "in": {"$subtract": ["$$this.買張", "$$this.賣張"]},
+                        }
+                    },
+                }
+            }
+        )
+
+        return list(self.db.chips.aggregate(pipeline))
+
+    def register_branch(self, code, name):
+        counter = self.db.counters.find_one_and_update(
+            {"_id": "branches"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+        self.db.branches.update_one(
+            {"code": code},
+            {"$setOnInsert": {"branchId": counter["seq"], "code": code, "name": name}},
+            upsert=True,
+        )
+
+        # another process may register the same code first
+        return self.db.branches.find_one({"code": code}, {"_id": 0})
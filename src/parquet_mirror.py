@@ -0,0 +1,232 @@
+import os
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient, ASCENDING
+from dotenv import load_dotenv
+
+from branch_registry import BranchRegistry, branch_id_column
+from trades_frame import to_naive_utc, pivot_daily_trades
+
+load_dotenv()
+
+MONGO_URL = os.environ.get("MONGO_URL")
+PARQUET_MIRROR_DIR = os.environ.get("PARQUET_MIRROR_DIR") or "mirror"
+
+date_column = "日期"
+quarter_column = "會計年季度"
+watermarks_file = "_watermarks.json"
+# branch of the single row written for a chips day without any row
+empty_day_branch = -1
+
+# collection: columns to find the rows a new document replaces in its partition
+MIRROR_COLLECTIONS = {
+    "dailyPrices": ["stockId", date_column],
+    "chips": ["stockId", date_column],
+    "stock_infos_quarter": ["stockId", quarter_column],
+}
+
+
+def get_year(collection, row):
+    if collection == "stock_infos_quarter":
+        return int(row[quarter_column][:4])
+
+    return row[date_column].year
+
+
+class ParquetMirror:
+    # {root}/{collection}/stockId={stock id}/year={year}/part.parquet
+    def __init__(self, root=PARQUET_MIRROR_DIR):
+        self.root = root
+
+    def get_partition_path(self, collection, stock_id, year):
+        return os.path.join(
+            self.root, collection, f"stockId={stock_id}", f"year={year}", "part.parquet"
+        )
+
+    def get_years(self, collection, stock_id):
+        stock_dir = os.path.join(self.root, collection, f"stockId={stock_id}")
+
+        if not os.path.exists(stock_dir):
+            return []
+
+        return sorted(int(name.split("=")[1]) for name in os.listdir(stock_dir))
+
+    def read(self, collection, stock_id, since_year=None):
+        frames = [
+            pd.read_parquet(self.get_partition_path(collection, stock_id, year))
+            for year in self.get_years(collection, stock_id)
+            if not since_year or year >= since_year
+        ]
+
+        if not frames:
+            return pd.DataFrame()
+
+        return pd.concat(frames, ignore_index=True)
+
+    def write(self, collection, stock_id, year, df):
+        path = self.get_partition_path(collection, stock_id, year)
+        replace_columns = MIRROR_COLLECTIONS[collection]
+
+        if os.path.exists(path):
+            existed_df = pd.read_parquet(path)
+
+            # same as `$setOnInsert`, rows already in mirror are kept
+            existed_keys = pd.MultiIndex.from_frame(existed_df[replace_columns])
+            new_keys = pd.MultiIndex.from_frame(df[replace_columns])
+            df = pd.concat(
+                [existed_df, df[~new_keys.isin(existed_keys)]], ignore_index=True
+            )
+
+        df = df.sort_values(replace_columns, kind="stable", ignore_index=True)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def get_watermarks(self):
+        path = os.path.join(self.root, watermarks_file)
+
+        if not os.path.exists(path):
+            return {}
+
+        with open(path) as f:
+            return {
+                collection: datetime.fromisoformat(watermark)
+                for collection, watermark in json.load(f).items()
+            }
+
+    def save_watermark(self, collection, watermark):
+        watermarks = self.get_watermarks()
+        watermarks[collection] = watermark
+
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, watermarks_file), "w") as f:
+            json.dump({key: value.isoformat() for key, value in watermarks.items()}, f)
+
+    def get_daily_trades_df(self, stock_id, chips_since_date):
+        chips_df = self.read("chips", stock_id, chips_since_date.year)
+
+        if chips_df.empty:
+            return pd.DataFrame()
+
+        chips_df = chips_df[chips_df[date_column] >= to_naive_utc(chips_since_date)]
+        chip_dates = pd.unique(chips_df[date_column].dt.date)
+        chips_df = chips_df[chips_df["branch"] != empty_day_branch]
+
+        trades_df = pd.DataFrame(
+            {
+                "date": chips_df[date_column].dt.date,
+                "branch": chips_df["branch"],
+                "net": chips_df["buy"] - chips_df["sell"],
+            }
+        )
+
+        return pivot_daily_trades(trades_df, chip_dates)
+
+    def get_daily_prices_df(self, stock_id, since_date):
+        prices_df = self.read("dailyPrices", stock_id, since_date.year)
+
+        if prices_df.empty:
+            return pd.DataFrame(columns=[date_column, "收盤價"])
+
+        prices_df = prices_df[prices_df[date_column] >= to_naive_utc(since_date)]
+
+        return prices_df.sort_values(date_column, ignore_index=True)
+
+
+def chips_to_rows(chips, branch_registry):
+    # one row per (stock, date, branch), instead of the nested data array
+    rows = []
+
+    for chip in chips:
+        # keep the day in mirror, see ParquetMirror.get_daily_trades_df
+        data = chip["data"] or [
+            {branch_id_column: empty_day_branch, "買張": 0, "賣張": 0, "買金額": 0, "賣金額": 0}
+        ]
+
+        for row in data:
+            rows.append(
+                {
+                    "stockId": chip["stockId"],
+                    date_column: chip[date_column],
+                    "branch": branch_registry.get_row_id(row),
+                    "buy": row["買張"],
+                    "sell": row["賣張"],
+                    "buyAmount": row["買金額"],
+                    "sellAmount": row["賣金額"],
+                    "createdAt": chip.get("createdAt"),
+                }
+            )
+
+    return rows
+
+
+def sync_collection(db, mirror, collection, branch_registry):
+    watermark = mirror.get_watermarks().get(collection)
+    # several documents share the createdAt of the same crawl, rows already in mirror are kept
+    query = {"createdAt": {"$gte": watermark}} if watermark else {}
+
+    stock_ids = sorted(db[collection].distinct("stockId", query))
+    print(f"{collection}: sync {len(stock_ids)} stocks since {watermark}")
+
+    new_watermark = watermark
+
+    for stock_id in stock_ids:
+        docs = list(
+            db[collection].find(
+                {**query, "stockId": stock_id},
+                {"_id": 0},
+                sort=[("createdAt", ASCENDING)],
+            )
+        )
+
+        if not docs:
+            continue
+
+        created_ats = [doc["createdAt"] for doc in docs if doc.get("createdAt")]
+        if created_ats:
+            new_watermark = max(filter(None, [new_watermark, max(created_ats)]))
+
+        if collection == "chips":
+            rows = chips_to_rows(docs, branch_registry)
+        else:
+            rows = docs
+
+        year_rows = {}
+        for row in rows:
+            year_rows.setdefault(get_year(collection, row), []).append(row)
+
+        for year, rows in year_rows.items():
+            df = pd.DataFrame(rows)
+
+            # keep columns type stable between partitions
+            if collection == "chips":
+                df = df.astype({"branch": np.int64, "buy": np.int64, "sell": np.int64})
+
+            mirror.write(collection, stock_id, year, df)
+
+    if new_watermark:
+        mirror.save_watermark(collection, new_watermark)
+
+
+def sync(db, mirror):
+    branch_registry = BranchRegistry(db)
+
+    for collection in MIRROR_COLLECTIONS:
+        sync_collection(db, mirror, collection, branch_registry)
+
+
+def main():
+    mongo_client = MongoClient(MONGO_URL)
+    db = mongo_client.get_default_database()
+
+    sync(db, ParquetMirror())
+
+    mongo_client.close()
+
+
+if __name__ == "__main__":
+    main()
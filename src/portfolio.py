@@ -1,20 +1,33 @@
 #  import pydash
 from stock import Stock
+from repository import as_repository
+from trade_ledger import TradeLedger
+from price_index import PriceIndex
 
 
 class Portfolio:
-    def __init__(self, db, init_money):
-        self.db = db
-        self.trade_history = []
+    def __init__(self, repository, init_money, price_index=None):
+        self.repository = as_repository(repository)
+        # shared by every Stock of the portfolio, prices of this repository only
+        self.price_index = PriceIndex() if price_index is None else price_index
+        # iterates as list of trade dict, see trade_ledger.py
+        self.trade_history = TradeLedger()
         self.current_portfolio = []
         self.current_cash = init_money
         self.assets_history = []
 
+        # running stats of trade_history, updated on every sell
+        self.realized_profit = 0
+        self.win_count = 0
+        self.trade_count = 0
+        # end quarter: profit of each holding, cleared when holdings change
+        self.holding_profits_cache = {}
+
     def buy_stocks(self, buy_stock_ids, quarter):
         cash_use_in_each_stock = self.current_cash / len(buy_stock_ids)
 
         for stock_id in buy_stock_ids:
-            stock = Stock(self.db, stock_id)
+            stock = Stock(self.repository, stock_id, price_index=self.price_index)
             price = stock.price_after_quarter_report(quarter, raise_error=True)
 
             self.current_portfolio.append(
@@ -27,10 +40,24 @@ class Portfolio:
             )
 
         self.current_cash = 0
+        self.holding_profits_cache = {}
+
+    def add_trade(self, trade):
+        self.trade_history.append(trade)
+
+        self.realized_profit += (trade["sell_price"] - trade["buy_price"]) * trade[
+            "buy_unit"
+        ]
+        self.trade_count += 1
+
+        if trade["is_profit"] is True:
+            self.win_count += 1
 
     def sell_all_stocks(self, quarter, days_delay=None):
         for port in self.current_portfolio:
-            stock = Stock(self.db, port["stock_id"])
+            stock = Stock(
+                self.repository, port["stock_id"], price_index=self.price_index
+            )
 
             if not days_delay:
                 price = stock.price_after_quarter_report(quarter)
@@ -40,7 +67,7 @@ class Portfolio:
                 if price != -1:
                     self.current_cash += stock_unit * price
 
-                    self.trade_history.append(
+                    self.add_trade(
                         {
                             **port,
                             "sell_price": price,
@@ -52,7 +79,7 @@ class Portfolio:
                     # FIXME: should get last price before stock disappeared
                     self.current_cash += stock_unit * port["buy_price"]
 
-                    self.trade_history.append(
+                    self.add_trade(
                         {
                             **port,
                             "sell_price": -1,
@@ -66,7 +93,7 @@ class Portfolio:
                 stock_unit = port["buy_unit"]
                 self.current_cash += stock_unit * price
 
-                self.trade_history.append(
+                self.add_trade(
                     {
                         **port,
                         "sell_price": price,
@@ -76,6 +103,7 @@ class Portfolio:
                 )
 
         self.current_portfolio = []
+        self.holding_profits_cache = {}
 
         self.assets_history.append(
             {
@@ -89,7 +117,7 @@ class Portfolio:
     #          if stock_id not in [stock["stock_id"] for stock in self.current_portfolio]:
     #              raise ValueError(f"stock_id {stock_id} does not exist in portfolio")
 
-    #          stock = Stock(self.db, stock_id)
+    #          stock = Stock(self.repository, stock_id)
     #          price = stock.price_after_quarter_report(quarter, raise_error=True)
 
     #          if price != -1:
@@ -104,26 +132,33 @@ class Portfolio:
 
     #          self.current_portfolio = pydash.remove(self.current_portfolio, lambda x: x["stock_id"] != stock_id)
 
-    def get_history_profit(self, end_quarter):
-        profit = 0
+    def get_holding_profits(self, end_quarter):
+        # mark-to-market of current portfolio, prices are only looked up once per end quarter
+        if end_quarter not in self.holding_profits_cache:
+            holding_profits = []
+
+            for portfolio in self.current_portfolio:
+                stock = Stock(
+                    self.repository, portfolio["stock_id"], price_index=self.price_index
+                )
+                price = stock.price_after_quarter_report(end_quarter, raise_error=True)
+
+                holding_profits.append(
+                    (portfolio["buy_price"] - price) * portfolio["buy_unit"]
+                )
 
-        for trade in self.trade_history:
-            profit += (trade["sell_price"] - trade["buy_price"]) * trade["buy_unit"]
+            self.holding_profits_cache[end_quarter] = holding_profits
 
-        for portfolio in self.current_portfolio:
-            stock = Stock(self.db, portfolio["stock_id"])
-            price = stock.price_after_quarter_report(end_quarter, raise_error=True)
+        return self.holding_profits_cache[end_quarter]
 
-            profit += (portfolio["buy_price"] - price) * portfolio["buy_unit"]
+    def get_history_profit(self, end_quarter):
+        profit = self.realized_profit
+
+        for holding_profit in self.get_holding_profits(end_quarter):
+            profit += holding_profit
 
         return round(profit, 4)
 
     @property
     def win_rate(self):
-        win_time = 0
-
-        for trade in self.trade_history:
-            if trade["is_profit"] is True:
-                win_time += 1
-
-        return round(win_time / len(self.trade_history), 4)
+        return round(self.win_count / self.trade_count, 4)
@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# (stock id, quarter) prices kept in memory
+PRICE_INDEX_SIZE = int(os.environ.get("PRICE_INDEX_SIZE") or 100000)
+
+# price of a stock can not be found for the quarter
+MISSING_PRICE = -1
+
+
+class PriceIndex:
+    # price after quarter report of (stock id, quarter) of one repository,
+    # shared by every Stock of a Portfolio so new Stock still hit the cache,
+    # max_size None keeps every price
+    def __init__(self, max_size=PRICE_INDEX_SIZE):
+        self.max_size = max_size
+        self.prices = OrderedDict()
+        self.lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def __len__(self):
+        return len(self.prices)
+
+    def get(self, stock_id, quarter):
+        # None if not cached, MISSING_PRICE if known to be missing
+        key = (stock_id, quarter)
+
+        with self.lock:
+            if key not in self.prices:
+                self.miss_count += 1
+                return None
+
+            self.hit_count += 1
+            self.prices.move_to_end(key)
+
+            return self.prices[key]
+
+    def put(self, stock_id, quarter, price):
+        key = (stock_id, quarter)
+
+        with self.lock:
+            self.prices[key] = price
+            self.prices.move_to_end(key)
+
+            while self.max_size and len(self.prices) > self.max_size:
+                self.prices.popitem(last=False)
+
+    def preload(self, repository, quarters):
+        # one read of prices_quarter for all quarters, e.g. at backtest start
+        price_quarters = repository.find_quarter_prices(quarters)
+
+        for price_quarter in price_quarters:
+            self.put(
+                price_quarter["stockId"], price_quarter["會計年季度"], price_quarter["price"]
+            )
+
+        print(f"preload {len(price_quarters)} prices of {len(quarters)} quarters")
+
+    def clear(self):
+        with self.lock:
+            self.prices.clear()
+            self.hit_count = 0
+            self.miss_count = 0
+
+    def print_stats(self):
+        total = self.hit_count + self.miss_count
+        hit_rate = round(self.hit_count * 100 / total, 2) if total else 0
+
+        print(
+            f"price index: {len(self.prices)} prices, "
+            f"{self.hit_count} hits, {self.miss_count} misses ({hit_rate} % hit)"
+        )
+
+
+# process-wide, only for stock_analysis.main which uses a single repository
+price_index = PriceIndex()
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+from trades_frame import to_naive_utc
+
+date_column = "日期"
+quarter_column = "會計年季度"
+
+# price after quarter report is the first close within this window after the deadline
+PRICE_WINDOW_DAYS = 10
+
+
+def get_report_deadline(quarter):
+    year = int(quarter[:-1])
+    quarter_num = int(quarter[-1])
+
+    if quarter_num == 1:
+        return datetime(year, 5, 15)
+    elif quarter_num == 2:
+        return datetime(year, 8, 14)
+    elif quarter_num == 3:
+        return datetime(year, 11, 14)
+    elif quarter_num == 4:
+        return datetime(year + 1, 3, 31)
+
+
+def merge_quarter_prices(targets_df, prices_df):
+    # targets_df: stockId, 會計年季度, deadline; prices_df: stockId, 日期, 收盤價
+    # same as Stock.get_price_from_daily_collection for every row, 收盤價 is NaN if missing
+    targets_df = targets_df.sort_values("deadline", kind="stable", ignore_index=True)
+    prices_df = prices_df.sort_values(date_column, kind="stable", ignore_index=True)
+
+    merged_df = pd.merge_asof(
+        targets_df,
+        prices_df,
+        left_on="deadline",
+        right_on=date_column,
+        by="stockId",
+        direction="forward",
+        allow_exact_matches=False,
+    )
+
+    out_of_window = merged_df[date_column] >= merged_df["deadline"] + timedelta(
+        days=PRICE_WINDOW_DAYS
+    )
+    merged_df.loc[out_of_window, [date_column, "收盤價"]] = np.nan
+
+    return merged_df
+
+
+def find_quarter_prices_df(repository, stock_quarters, chunk_size=50):
+    # stock_quarters: list of (stock id, quarter), one daily prices scan per chunk of stocks
+    targets_df = pd.DataFrame(stock_quarters, columns=["stockId", quarter_column])
+    targets_df = targets_df.drop_duplicates(ignore_index=True)
+    targets_df["deadline"] = pd.to_datetime(
+        [get_report_deadline(quarter) for quarter in targets_df[quarter_column]]
+    ).astype("datetime64[ns]")
+
+    stock_ids = list(pd.unique(targets_df["stockId"]))
+    merged_dfs = []
+
+    for idx in range(0, len(stock_ids), chunk_size):
+        chunk_stock_ids = stock_ids[idx : idx + chunk_size]
+        chunk_targets_df = targets_df[targets_df["stockId"].isin(chunk_stock_ids)]
+
+        # prices on or after the window of the last deadline are never picked
+        prices = repository.find_stocks_daily_prices(
+            chunk_stock_ids,
+            chunk_targets_df["deadline"].min().to_pydatetime(),
+            chunk_targets_df["deadline"].max().to_pydatetime()
+            + timedelta(days=PRICE_WINDOW_DAYS),
+        )
+
+        prices_df = pd.DataFrame(
+            {
+                "stockId": pd.Series(
+                    [price["stockId"] for price in prices],
+                    dtype=targets_df["stockId"].dtype,
+                ),
+                date_column: pd.to_datetime(
+                    [to_naive_utc(price[date_column]) for price in prices]
+                ).astype("datetime64[ns]"),
+                "收盤價": np.array([price["收盤價"] for price in prices], np.float64),
+            }
+        )
+
+        merged_dfs.append(merge_quarter_prices(chunk_targets_df, prices_df))
+
+    if not merged_dfs:
+        return pd.DataFrame(
+            columns=["stockId", quarter_column, "deadline", date_column, "收盤價"]
+        )
+
+    return pd.concat(merged_dfs, ignore_index=True)
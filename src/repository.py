@@ -0,0 +1,33 @@
+import os
+from pymongo import MongoClient
+from pymongo.database import Database
+from dotenv import load_dotenv
+
+from mongo_repository import MongoRepository
+from sqlite_repository import SQLiteRepository, SQLITE_PATH
+
+load_dotenv()
+
+MONGO_URL = os.environ.get("MONGO_URL")
+# mongo or sqlite
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND") or "mongo"
+
+
+def as_repository(db):
+    # Stock and Portfolio still accept a pymongo database
+    if isinstance(db, Database):
+        return MongoRepository(db)
+
+    return db
+
+
+def get_repository(tz_aware=False):
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteRepository(SQLITE_PATH)
+
+    if STORAGE_BACKEND == "mongo":
+        mongo_client = MongoClient(MONGO_URL, tz_aware=tz_aware)
+
+        return MongoRepository(mongo_client.get_default_database(), mongo_client)
+
+    raise ValueError(STORAGE_BACKEND, "unknown STORAGE_BACKEND")
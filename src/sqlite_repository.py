@@ -0,0 +1,164 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+
+from base_repository import Repository, date_column, quarter_column
+from trades_frame import to_naive_utc
+
+load_dotenv()
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH") or "stock-crawler.sqlite"
+
+
+def encode_json(value):
+    if isinstance(value, datetime):
+        return {"$date": to_naive_utc(value).isoformat()}
+
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+def decode_json(value):
+    if "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+
+    return value
+
+
+class SQLiteRepository(Repository):
+    # one table per collection, key columns for filtering and the whole document as JSON
+    def __init__(self, path=SQLITE_PATH):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.tables = set()
+
+    def get_table(self, collection):
+        if collection not in self.tables:
+            with self.lock:
+                self.connection.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{collection}" ('
+                    "key TEXT PRIMARY KEY, stockId TEXT, quarter TEXT, date TEXT, doc TEXT)"
+                )
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{collection}_stock_date" '
+                    f'ON "{collection}" (stockId, date)'
+                )
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{collection}_quarter" '
+                    f'ON "{collection}" (quarter, stockId)'
+                )
+                self.connection.commit()
+
+            self.tables.add(collection)
+
+        return f'"{collection}"'
+
+    def find(
+        self,
+        collection,
+        stock_id=None,
+        stock_ids=None,
+        quarter=None,
+        since_date=None,
+        after_date=None,
+        before_date=None,
+        sort=None,
+        limit=None,
+    ):
+        conditions = []
+        params = []
+
+        if stock_ids is not None:
+            stock_ids = list(stock_ids)
+            conditions.append(f"stockId IN ({', '.join('?' * len(stock_ids))})")
+            params.extend(stock_ids)
+
+        for condition, value in [
+            ("stockId = ?", stock_id),
+            ("quarter = ?", quarter),
+            ("date >= ?", since_date),
+            ("date > ?", after_date),
+            ("date < ?", before_date),
+        ]:
+            if value is None:
+                continue
+
+            if isinstance(value, datetime):
+                value = to_naive_utc(value).isoformat()
+
+            conditions.append(condition)
+            params.append(value)
+
+        sql = f"SELECT doc FROM {self.get_table(collection)}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if sort:
+            sql += " ORDER BY date " + ("ASC" if sort > 0 else "DESC")
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+
+        return [json.loads(row[0], object_hook=decode_json) for row in rows]
+
+    def upsert_many(self, collection, docs, key_columns):
+        rows = []
+
+        for doc in docs:
+            date = doc.get(date_column)
+
+            rows.append(
+                (
+                    json.dumps([doc[key] for key in key_columns], default=encode_json),
+                    doc.get("stockId"),
+                    doc.get(quarter_column),
+                    to_naive_utc(date).isoformat() if date else None,
+                    json.dumps(
+                        {key: value for key, value in doc.items() if key != "_id"},
+                        default=encode_json,
+                        ensure_ascii=False,
+                    ),
+                )
+            )
+
+        table = self.get_table(collection)
+
+        with self.lock:
+            before_count = self.connection.total_changes
+            self.connection.executemany(
+                f"INSERT OR IGNORE INTO {table} VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self.connection.commit()
+
+            return self.connection.total_changes - before_count
+
+    def distinct_dates(self, collection, since_date=None):
+        sql = f"SELECT DISTINCT date FROM {self.get_table(collection)} WHERE date IS NOT NULL"
+        params = []
+
+        if since_date:
+            sql += " AND date >= ?"
+            params.append(to_naive_utc(since_date).isoformat())
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+
+        return [datetime.fromisoformat(row[0]) for row in rows]
+
+    def delete_many(self, collection, stock_id, since_date):
+        table = self.get_table(collection)
+
+        with self.lock:
+            cursor = self.connection.execute(
+                f"DELETE FROM {table} WHERE stockId = ? AND date >= ?",
+                (stock_id, to_naive_utc(since_date).isoformat()),
+            )
+            self.connection.commit()
+
+        return cursor.rowcount
+
+    def close(self):
+        self.connection.close()
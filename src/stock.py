@@ -1,17 +1,32 @@
-from pymongo import ASCENDING
+import numpy as np
 import pandas as pd
 import pytz
-from datetime import datetime, timedelta
+from datetime import timedelta
+
+import chips_bucket
+from branch_registry import BranchRegistry
+import branch_positions
+from repository import as_repository
+from quarter_price import get_report_deadline, PRICE_WINDOW_DAYS
+from price_index import PriceIndex, MISSING_PRICE
+from trades_frame import (
+    pivot_daily_trades,
+    to_datetime_index,
+    load_daily_prices_df,
+    load_daily_trades_df,
+)
 
 TPE_TIMEZONE = pytz.timezone("Asia/Taipei")
 
 
 class StockQuarter:
-    def __init__(self, db, quarter_info):
-        self.db = db
+    def __init__(self, repository, quarter_info, price_index=None):
+        self.repository = as_repository(repository)
         self.quarter_info = quarter_info
         self.quarter = quarter_info["會計年季度"]
-        self.stock = Stock(db, quarter_info["stockId"])
+        self.stock = Stock(
+            self.repository, quarter_info["stockId"], price_index=price_index
+        )
 
     @property
     def EV(self):
@@ -65,26 +80,57 @@ class StockQuarter:
 
 
 class Stock:
-    def __init__(self, db, id):
+    def __init__(
+        self,
+        repository,
+        id,
+        chips_layout="documents",
+        branch_registry=None,
+        mirror=None,
+        price_index=None,
+    ):
         self.id = id
-        self.db = db
-        self.quarter_price_map = {}
+        # see repository.py, a pymongo database is also accepted
+        self.repository = as_repository(repository)
+        # prices of this repository only, shared if given, see price_index.py
+        self.price_index = PriceIndex() if price_index is None else price_index
+        # "documents": one chips document per day, "buckets": chips_buckets collection,
+        # "aggregate": chips documents summed up by the database, see find_daily_branch_nets,
+        # "positions": monthly running positions of branch_positions.py pick the branches
+        self.chips_layout = chips_layout
+        self._branch_registry = branch_registry
+        # read chips and daily prices from ParquetMirror instead of mongo if set
+        self.mirror = mirror
 
-    def price_after_quarter_report(self, quarter, raise_error=False):
-        if quarter in self.quarter_price_map:
-            return self.quarter_price_map[quarter]
+    @property
+    def branch_registry(self):
+        if not self._branch_registry:
+            self._branch_registry = BranchRegistry(self.repository)
 
-        price_quarter = self.db.prices_quarter.find_one(
-            {
-                "stockId": self.id,
-                "會計年季度": quarter,
-            },
-        )
+        return self._branch_registry
+
+    def find_price_after_quarter_report(self, quarter):
+        price_quarter = self.repository.find_quarter_price(self.id, quarter)
 
         if not price_quarter:
             price_quarter = self.get_price_from_daily_collection(quarter)
 
         if not price_quarter:
+            return MISSING_PRICE
+
+        if "price" in price_quarter:
+            return price_quarter["price"]
+
+        return price_quarter["收盤價"]
+
+    def price_after_quarter_report(self, quarter, raise_error=False):
+        price = self.price_index.get(self.id, quarter)
+
+        if price is None:
+            price = self.find_price_after_quarter_report(quarter)
+            self.price_index.put(self.id, quarter, price)
+
+        if price == MISSING_PRICE:
             if raise_error:
                 raise ValueError(
                     f"missing price in stockId {self.id}, quarter {quarter}"
@@ -93,41 +139,22 @@ class Stock:
                 print(f"stock_id: {self.id}, quarter: {quarter}, can not find price")
                 return -1
 
-        if "price" in price_quarter:
-            self.quarter_price_map[quarter] = price_quarter["price"]
-        else:
-            self.quarter_price_map[quarter] = price_quarter["收盤價"]
-
-        return self.quarter_price_map[quarter]
+        return price
 
     def get_price_from_daily_collection(self, quarter, days_delay=None):
-        year = int(quarter[:-1])
-        quarter_num = int(quarter[-1])
-
-        if quarter_num == 1:
-            after_date = datetime(year, 5, 15)
-        elif quarter_num == 2:
-            after_date = datetime(year, 8, 14)
-        elif quarter_num == 3:
-            after_date = datetime(year, 11, 14)
-        elif quarter_num == 4:
-            after_date = datetime(year + 1, 3, 31)
+        after_date = get_report_deadline(quarter)
 
         if days_delay:
             after_date += timedelta(days=days_delay)
 
-        price = self.db.dailyPrices.find_one(
-            {
-                "stockId": self.id,
-                "日期": {"$gt": after_date, "$lt": after_date + timedelta(days=10)},
-            },
-            sort=[("日期", 1)],
+        price = self.repository.find_first_daily_price(
+            self.id, after_date, after_date + timedelta(days=PRICE_WINDOW_DAYS)
         )
 
         return price
 
     def get_custom_threshold(self):
-        stock = self.db["stocks"].find_one({"stockId": self.id})
+        stock = self.repository.find_stock(self.id)
 
         default_threshold = 100
 
@@ -137,73 +164,146 @@ class Stock:
 
         return big_trader_threshold
 
-    def get_trade_df(self, chips_since_date, big_trader_threshold):
-        chips_collection = "chips"
-        date = "日期"
-        buyNum = "買張"
-        sellNum = "賣張"
-        agentName = "分點名稱"
-
-        daily_trades = list(
-            self.db[chips_collection].find(
-                {"stockId": self.id, date: {"$gte": chips_since_date}}
+    def get_daily_trades_df(self, chips_since_date):
+        # columns are branch ids, translate to branch names in get_trade_df
+        if self.mirror:
+            return self.mirror.get_daily_trades_df(self.id, chips_since_date)
+
+        # buckets only exist in mongo
+        if self.chips_layout == "buckets":
+            return chips_bucket.get_daily_trades_df(
+                self.repository.db, self.id, chips_since_date, self.branch_registry
             )
+
+        if self.chips_layout == "aggregate":
+            return self.get_daily_trades_df_from_nets(chips_since_date)
+
+        return load_daily_trades_df(
+            self.repository.iter_chips(self.id, chips_since_date),
+            self.branch_registry.find_row_id,
         )
 
-        if not daily_trades:
-            raise ValueError(daily_trades, f"stock id {self.id} may not be crawled yet")
+    def get_daily_trades_df_from_nets(self, chips_since_date, branches=None):
+        daily_nets = self.repository.find_daily_branch_nets(
+            self.id, chips_since_date, branches
+        )
 
-        daily_trades_stats = []
+        if not daily_nets:
+            return pd.DataFrame()
 
-        for daily_trade in daily_trades:
-            count_daily_traders = map(
-                lambda trade: {
-                    **trade,
-                    "quantitiesCount": trade[buyNum] - trade[sellNum],
-                },
-                daily_trade["data"],
-            )
-            big_traders = list(count_daily_traders)
+        id_by_code = self.branch_registry.id_by_code
 
-            daily_trades_stats.append(
-                {trader[agentName]: trader["quantitiesCount"] for trader in big_traders}
-            )
+        trades_df = pd.DataFrame(
+            {
+                "date": [
+                    day["_id"].date()
+                    for day in daily_nets
+                    for _ in range(len(day["nets"]))
+                ],
+                # branch code of rows before BranchRegistry, same as BranchRegistry.find_row_id
+                "branch": [
+                    id_by_code.get(branch, name) if isinstance(branch, str) else branch
+                    for day in daily_nets
+                    for branch, name in zip(day["branches"], day["names"])
+                ],
+                "net": [net for day in daily_nets for net in day["nets"]],
+            }
+        )
+
+        return pivot_daily_trades(trades_df, [day["_id"].date() for day in daily_nets])
+
+    def get_daily_trades_df_from_positions(
+        self, chips_since_date, big_trader_threshold
+    ):
+        # pick branches by the change of two snapshots, then only read daily nets of them,
+        # None if positions of the stock are not built yet
+        change = branch_positions.get_position_change(
+            self.repository, self.id, chips_since_date, self.branch_registry
+        )
 
-        daily_trades_df = pd.DataFrame(
-            daily_trades_stats,
-            index=map(lambda trade: trade[date].date(), daily_trades),
+        if change is None:
+            return None
+
+        # same filter as get_trade_df, on branches merged by name
+        names = change.index.map(self.branch_registry.get_name)
+        name_change = change.groupby(names).sum()
+        big_trader_names = set(
+            name_change.index[abs(name_change) > big_trader_threshold]
+        )
+
+        # a branch with no change still counts in the daily nets of its name
+        branch_ids = set(change.index[names.isin(big_trader_names)]) | {
+            branch_id
+            for branch_id, name in self.branch_registry.name_by_id.items()
+            if name in big_trader_names
+        }
+
+        # rows before BranchRegistry keep branch code
+        branch_codes = {
+            code
+            for code, branch_id in self.branch_registry.id_by_code.items()
+            if branch_id in branch_ids
+        }
+
+        return self.get_daily_trades_df_from_nets(
+            chips_since_date, branch_ids | branch_codes
         )
 
+    def merge_branch_columns(self, trades_df):
+        # branch id columns to 分點名稱, branches with the same name are summed as one column
+        trades_df = trades_df.rename(columns=self.branch_registry.get_name)
+
+        return trades_df.T.groupby(level=0, sort=False).sum().T
+
+    def get_trade_df(self, chips_since_date, big_trader_threshold):
+        if self.chips_layout == "positions":
+            daily_trades_df = self.get_daily_trades_df_from_positions(
+                chips_since_date, big_trader_threshold
+            )
+        else:
+            daily_trades_df = self.get_daily_trades_df(chips_since_date)
+
+        # no positions snapshot or no chips day, a day without any big trader is still a row
+        if daily_trades_df is None or daily_trades_df.index.empty:
+            raise ValueError(
+                daily_trades_df, f"stock id {self.id} may not be crawled yet"
+            )
+
         # fill NaN to 0 and do cumsum
-        cusum_trades_df = daily_trades_df.fillna(0).cumsum()
+        cusum_trades_df = self.merge_branch_columns(daily_trades_df.fillna(0).cumsum())
 
         # filter columns according to last row value
-        big_trader_filter = abs(cusum_trades_df[-1:].squeeze()) > big_trader_threshold
+        big_trader_filter = abs(cusum_trades_df.iloc[-1]) > big_trader_threshold
 
         big_trades_df = cusum_trades_df.loc[:, big_trader_filter]
 
         # sort columns according to last row value
         big_trades_df = big_trades_df.sort_values(
-            big_trades_df.last_valid_index(), axis="columns", ascending=False
+            big_trades_df.index[-1], axis="columns", ascending=False
         )
 
         #  print(big_trades_df.to_markdown())
 
         return big_trades_df
 
-    def get_price_dataframe(self, chips_since_date):
-        prices = list(
-            self.db.dailyPrices.find(
-                {"stockId": self.id, "日期": {"$gte": chips_since_date}},
-                {"_id": 0, "收盤價": 1, "日期": 1},
-            ).sort([("日期", ASCENDING)])
-        )
+    def get_daily_prices_df(self, since_date):
+        # index is tz-aware DatetimeIndex in TPE_TIMEZONE
+        if self.mirror:
+            prices_df = self.mirror.get_daily_prices_df(self.id, since_date)
+
+            return pd.DataFrame(
+                {"price": prices_df["收盤價"].to_numpy(np.float64)},
+                index=to_datetime_index(prices_df["日期"], TPE_TIMEZONE),
+            )
 
-        prices_df = pd.DataFrame(
-            map(lambda e: {"price": e["收盤價"]}, prices),
-            index=map(lambda p: p["日期"].astimezone(TPE_TIMEZONE).date(), prices),
+        return load_daily_prices_df(
+            self.repository.iter_daily_prices(self.id, since_date), TPE_TIMEZONE
         )
 
+    def get_price_dataframe(self, chips_since_date):
+        prices_df = self.get_daily_prices_df(chips_since_date)
+        prices_df.index = prices_df.index.date
+
         #  print(prices_df.to_markdown())
 
         return prices_df
@@ -1,19 +1,15 @@
-import os
-from pymongo import MongoClient
 from dotenv import load_dotenv
-import heapq
-import pandas as pd
 
+import factor_engine
+from factor_store import FactorStore
 from portfolio import Portfolio
-from stock import StockQuarter
+from repository import get_repository
+from price_index import price_index
+from equity_curve import get_risk_report
+from backtest_cache import BacktestCache, get_data_watermarks
 
 load_dotenv()
 
-MONGO_URL = os.environ.get("MONGO_URL")
-
-mongo_client = MongoClient(MONGO_URL)
-db = mongo_client.get_default_database()
-
 
 def generate_quarters(start_quarter, end_quarter):
     start_year = int(start_quarter[:-1])
@@ -42,38 +38,18 @@ def generate_quarters(start_quarter, end_quarter):
     return account_quarters
 
 
-def EBITDA_strategy(portfolio, account_quarters, portfolio_count, end_quarter):
-    print("===== EBITDA strategy =====")
-    stocks_quarter_rank = {}
-
-    for quarter in account_quarters:
-        print(f"quarter: {quarter}")
-        stock_infos = db.stock_infos_quarter.find(
-            {
-                "會計年季度": quarter,
-                "isTop200Company": {"$ne": True},
-                "普通股股本": {"$gt": 0},
-                "毛利": {"$ne": 0},
-                "營業利益": {"$ne": 0},
-            }
-        )
-        stocks_EBITDA_mod_EV = {}
+def get_EBITDA_panel(factors_df, account_quarters):
+    # quarter x stock EBITDA_mod_EV of candidates
+    factor_df = factors_df[factors_df["isEBITDACandidate"]]
+    panel = factor_engine.get_factor_panel(factor_df, "EBITDA_mod_EV")
 
-        for info in stock_infos:
-            stock_quarter = StockQuarter(db, info)
+    return panel.reindex(account_quarters)
 
-            val = stock_quarter.EBITDA_mod_EV
-            if val > 0:
-                stocks_EBITDA_mod_EV[stock_quarter.stock.id] = val
-
-        stocks_quarter_rank[quarter] = heapq.nlargest(
-            portfolio_count, stocks_EBITDA_mod_EV, key=stocks_EBITDA_mod_EV.get
-        )
-
-    stocks_rank_df = pd.DataFrame(stocks_quarter_rank)
 
+def rebalance(portfolio, stocks_rank_df, account_quarters, end_quarter):
+    # sell everything and buy stocks of stocks_rank_df column on every quarter
     for curr_quarter in account_quarters:
-        buy_stock_ids = stocks_rank_df[curr_quarter]
+        buy_stock_ids = list(stocks_rank_df[curr_quarter].dropna())
 
         portfolio.sell_all_stocks(curr_quarter)
 
@@ -81,11 +57,50 @@ def EBITDA_strategy(portfolio, account_quarters, portfolio_count, end_quarter):
 
     portfolio.sell_all_stocks(end_quarter)
 
+
+def EBITDA_strategy(
+    repository,
+    portfolio,
+    account_quarters,
+    portfolio_count,
+    end_quarter,
+    factors_df=None,
+):
+    print("===== EBITDA strategy =====")
+
+    # factors_df: rows of FactorStore, otherwise all quarters at once, see factor_engine.py
+    if factors_df is None:
+        factor_df = factor_engine.get_EBITDA_mod_EV_df(
+            repository, account_quarters, portfolio.price_index
+        )
+    else:
+        factor_df = factors_df[
+            factors_df["isEBITDACandidate"] & factors_df["會計年季度"].isin(account_quarters)
+        ]
+
+    panel = get_EBITDA_panel(factor_df, account_quarters)
+
+    stocks_rank_df = factor_engine.rank_panel(panel, [portfolio_count])[portfolio_count]
+
+    rebalance(portfolio, stocks_rank_df, account_quarters, end_quarter)
+
+
+def get_result(repository, portfolio, init_money, end_quarter):
+    return {
+        "assets_history": portfolio.assets_history,
+        "profit": portfolio.get_history_profit(end_quarter),
+        "winRate": portfolio.win_rate,
+        "risk": get_risk_report(repository, portfolio, init_money),
+    }
+
+
+def print_result(name, result):
     print("=============================")
-    print("EBITDA portfolio")
-    print(portfolio.assets_history)
-    print(portfolio.get_history_profit(end_quarter))
-    print(f"win rate: {portfolio.win_rate * 100} %")
+    print(f"{name} portfolio")
+    print(result["assets_history"])
+    print(result["profit"])
+    print(f"win rate: {result['winRate'] * 100} %")
+    print(f"daily risk: {result['risk']}")
     print("=============================")
 
 
@@ -103,6 +118,8 @@ def EBITDA_strategy(portfolio, account_quarters, portfolio_count, end_quarter):
 
 
 def main():
+    repository = get_repository()
+
     account_quarters = []
 
     start_quarter = "20161"
@@ -112,25 +129,74 @@ def main():
 
     account_quarters = generate_quarters(start_quarter, end_quarter)
 
-    market_portfolio = Portfolio(db, init_money)
+    config = {
+        "start_quarter": start_quarter,
+        "end_quarter": end_quarter,
+        "init_money": init_money,
+    }
 
-    for curr_quarter in account_quarters:
-        market_portfolio.sell_all_stocks(curr_quarter)
+    # results are cached until new documents come into the input collections
+    cache = BacktestCache()
+    watermarks = get_data_watermarks(repository)
 
-        market_portfolio.buy_stocks(["0050"], curr_quarter)
+    def preload_prices():
+        # prices_quarter of the whole backtest in one read
+        if not len(price_index):
+            price_index.preload(repository, account_quarters + [end_quarter])
 
-    market_portfolio.sell_all_stocks(end_quarter)
+    def run_market():
+        preload_prices()
 
-    print("=============================")
-    print("0050 portfolio")
-    print(market_portfolio.assets_history)
-    print(market_portfolio.get_history_profit(end_quarter))
-    print(f"win rate: {market_portfolio.win_rate * 100} %")
-    print("=============================")
+        market_portfolio = Portfolio(repository, init_money, price_index)
+
+        for curr_quarter in account_quarters:
+            market_portfolio.sell_all_stocks(curr_quarter)
+
+            market_portfolio.buy_stocks(["0050"], curr_quarter)
+
+        market_portfolio.sell_all_stocks(end_quarter)
+
+        result = get_result(repository, market_portfolio, init_money, end_quarter)
+
+        return result, market_portfolio.trade_history
+
+    market_result = cache.get_or_run(
+        {**config, "strategy": "market"}, watermarks, run_market
+    )
+    print_result("0050", market_result)
+
+    def run_EBITDA():
+        preload_prices()
+
+        # factors of new reports are computed again, others are read from disk
+        factors_df = FactorStore().refresh(repository, price_index)
+
+        portfolio = Portfolio(repository, init_money, price_index)
+
+        EBITDA_strategy(
+            repository,
+            portfolio,
+            account_quarters,
+            portfolio_count,
+            end_quarter,
+            factors_df,
+        )
+
+        return (
+            get_result(repository, portfolio, init_money, end_quarter),
+            portfolio.trade_history,
+        )
+
+    EBITDA_result = cache.get_or_run(
+        {**config, "strategy": "EBITDA", "portfolio_count": portfolio_count},
+        watermarks,
+        run_EBITDA,
+    )
+    print_result("EBITDA", EBITDA_result)
 
-    portfolio = Portfolio(db, init_money)
+    price_index.print_stats()
 
-    EBITDA_strategy(portfolio, account_quarters, portfolio_count, end_quarter)
+    repository.close()
 
 
 if __name__ == "__main__":
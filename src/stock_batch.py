@@ -0,0 +1,62 @@
+import os
+from dotenv import load_dotenv
+
+from stock import Stock
+from memory_repository import MemoryRepository
+
+load_dotenv()
+
+# stocks per `$in` query
+STOCK_CHUNK_SIZE = int(os.environ.get("STOCK_CHUNK_SIZE") or 50)
+
+date_column = "日期"
+
+
+def group_by_stock(docs):
+    docs_by_stock = {}
+
+    for doc in docs:
+        docs_by_stock.setdefault(doc["stockId"], []).append(doc)
+
+    return docs_by_stock
+
+
+class StockBatchLoader:
+    # load chips and daily prices of many stocks with two queries per chunk of stocks,
+    # each Stock gets a MemoryRepository holding only its own documents
+    def __init__(self, repository, since_date, chunk_size=STOCK_CHUNK_SIZE):
+        self.repository = repository
+        self.since_date = since_date
+        self.chunk_size = chunk_size
+        self.query_count = 0
+
+    def load_chunk(self, stocks):
+        stock_ids = [stock["stockId"] for stock in stocks]
+
+        chips = group_by_stock(
+            self.repository.find_stocks_chips(stock_ids, self.since_date)
+        )
+        prices = group_by_stock(
+            self.repository.find_stocks_daily_prices(stock_ids, self.since_date)
+        )
+        self.query_count += 2
+
+        return {
+            stock["stockId"]: MemoryRepository(
+                {
+                    # stock document carries threshold
+                    "stocks": [stock],
+                    "chips": chips.get(stock["stockId"], []),
+                    "dailyPrices": prices.get(stock["stockId"], []),
+                }
+            )
+            for stock in stocks
+        }
+
+    def iter_stocks(self, stocks, chips_layout="documents", branch_registry=None):
+        # stocks: documents of stocks collection, e.g. repository.find_stocks()
+        for idx in range(0, len(stocks), self.chunk_size):
+            repositories = self.load_chunk(stocks[idx : idx + self.chunk_size])
+
+            for stock_id, repository in repositories.items():
+                yield Stock(repository, stock_id, chips_layout, branch_registry)
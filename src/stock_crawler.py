@@ -1,23 +1,29 @@
 import os
-import requests
+import asyncio
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
 from dateutil.rrule import rrule, DAILY
 from dotenv import load_dotenv
 from urllib.parse import urlencode
 
+from http_client import get_session
+from cmoney_token import token_store
+
 load_dotenv()
 
-CMONEY_ACCOUNT = os.environ.get("CMONEY_ACCOUNT")
-CMONEY_HASHED_PASSWORD = os.environ.get("CMONEY_HASHED_PASSWORD")
+CHIPS_CONCURRENCY = int(os.environ.get("CHIPS_CONCURRENCY") or 8)
 
 
 class StockCrawler:
-    def __init__(self, stock_id, date_column):
+    def __init__(
+        self, stock_id, date_column, trading_calendar=None, branch_registry=None
+    ):
         self.stock_id = stock_id
         self.date_column = date_column
-        self.access_token = None
+        self.trading_calendar = trading_calendar
+        self.branch_registry = branch_registry
 
     def get_daily_prices(self, since_date, until_date):
         url = "https://api.cmoney.tw/MobileService/ashx/GetDtnoData.ashx"
@@ -37,7 +43,7 @@ class StockCrawler:
         }
 
         time.sleep(0.1)
-        res = requests.get(url, params=urlencode(params, safe=";"))
+        res = get_session().get(url, params=urlencode(params, safe=";"))
 
         daily_prices = json.loads(res.text)
 
@@ -67,8 +73,13 @@ class StockCrawler:
 
         return format_daily_prices
 
-    def get_chips(self, since_date, until_date):
-        dates = [
+    def get_chip_dates(self, since_date, until_date):
+        if self.trading_calendar:
+            return self.trading_calendar.get_trading_days(
+                since_date, until_date - timedelta(days=1)
+            )
+
+        return [
             dt
             for dt in rrule(
                 DAILY,
@@ -78,6 +89,9 @@ class StockCrawler:
             )
         ]
 
+    def get_chips(self, since_date, until_date):
+        dates = self.get_chip_dates(since_date, until_date)
+
         daily_chips = []
 
         for date in dates:
@@ -96,6 +110,26 @@ class StockCrawler:
 
         return daily_chips
 
+    async def get_chips_async(self, since_date, until_date, semaphore, executor):
+        dates = self.get_chip_dates(since_date, until_date)
+
+        loop = asyncio.get_running_loop()
+
+        async def get_chip(date):
+            async with semaphore:
+                print(f"stock id: {self.stock_id}, date: {date}")
+
+                chips = await loop.run_in_executor(executor, self.get_date_chips, date)
+
+            return {
+                "stockId": self.stock_id,
+                self.date_column: date,
+                "data": chips,
+            }
+
+        # gather keeps the order of dates, same as get_chips
+        return list(await asyncio.gather(*[get_chip(date) for date in dates]))
+
     def get_date_chips(self, date):
         access_token = self.get_cmoney_access_token()
 
@@ -104,58 +138,52 @@ class StockCrawler:
         params = f"{self.stock_id}_{date_str}_1_1"
         chips_url = "http://datasv.cmoney.tw:5000/api/chipk"
 
-        res = requests.get(
-            chips_url,
-            params={
-                "appId": "2",
-                "needLog": "true",
-                "fundId": "2",
-                "params": params,
-            },
-            headers={
-                "Authorization": f"Bearer {access_token}",
-            },
-        )
-
-        daily_chips = json.loads(res.text)
+        def get_chips_response(access_token):
+            return get_session().get(
+                chips_url,
+                params={
+                    "appId": "2",
+                    "needLog": "true",
+                    "fundId": "2",
+                    "params": params,
+                },
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                },
+            )
 
-        format_daily_chips = []
+        res = get_chips_response(access_token)
 
-        for data in daily_chips["data"]:
-            format_daily_chips.append(
-                {
-                    "分點代號": data[1],
-                    "分點名稱": data[2],
-                    "買張": int(data[3]),
-                    "賣張": int(data[4]),
-                    "買金額": int(data[5]),
-                    "賣金額": int(data[6]),
-                }
+        if res.status_code == 401:
+            print(
+                f"stock id: {self.stock_id}, date: {date}, token is rejected, login again"
             )
+            access_token = token_store.refresh(access_token)
+            res = get_chips_response(access_token)
 
-        return format_daily_chips
-
-    def get_cmoney_access_token(self):
-        if self.access_token:
-            return self.access_token
+        daily_chips = json.loads(res.text)
 
-        access_token_url = "https://api.cmoney.tw/identity/token"
+        format_daily_chips = []
 
-        data = {
-            "account": CMONEY_ACCOUNT,
-            "hashed_password": CMONEY_HASHED_PASSWORD,
-            "grant_type": "password",
-            "client_id": "cmchipkmobile",
-            "login_method": "email",
-        }
+        for data in daily_chips["data"]:
+            chip = {
+                "分點代號": data[1],
+                "分點名稱": data[2],
+                "買張": int(data[3]),
+                "賣張": int(data[4]),
+                "買金額": int(data[5]),
+                "賣金額": int(data[6]),
+            }
 
-        res = requests.post(access_token_url, data=data)
+            if self.branch_registry:
+                chip = self.branch_registry.encode_row(chip)
 
-        token_info = json.loads(res.text)
+            format_daily_chips.append(chip)
 
-        self.access_token = token_info["access_token"]
+        return format_daily_chips
 
-        return self.access_token
+    def get_cmoney_access_token(self):
+        return token_store.get()
 
     def get_year_report(self, since_year, until_year):
         pick_int_column = [
@@ -224,7 +252,7 @@ class StockCrawler:
 
         url = f"https://statementdog.com/api/v2/fundamentals/{self.stock_id}/{since_year}/{until_year}/cf"
 
-        res = requests.get(url)
+        res = get_session().get(url)
 
         stock_info = json.loads(res.text)
 
@@ -287,3 +315,35 @@ class StockCrawler:
             )
 
         return infos
+
+
+def get_chips_concurrently(jobs, until_date, on_chips, concurrency=CHIPS_CONCURRENCY):
+    # jobs: list of (stock_crawler, since_date)
+    # on_chips is called with (stock_crawler, chips) once all dates of a stock are fetched,
+    # or with (stock_crawler, exception) if any of them failed
+
+    async def crawl():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+            async def crawl_stock(stock_crawler, since_date):
+                try:
+                    chips = await stock_crawler.get_chips_async(
+                        since_date, until_date, semaphore, executor
+                    )
+                except Exception as e:
+                    return stock_crawler, e
+
+                return stock_crawler, chips
+
+            tasks = [
+                crawl_stock(stock_crawler, since_date)
+                for stock_crawler, since_date in jobs
+            ]
+
+            for task in asyncio.as_completed(tasks):
+                stock_crawler, result = await task
+                on_chips(stock_crawler, result)
+
+    asyncio.run(crawl())
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+# is_profit of a trade: 1 profit, 0 loss, -1 price can not be found (None in trade dict)
+trade_dtype = np.dtype(
+    [
+        ("stock_id", "U16"),
+        ("buy_price", np.float64),
+        ("buy_unit", np.float64),
+        ("buy_quarter", "U8"),
+        ("sell_price", np.float64),
+        ("sell_quarter", "U8"),
+        ("is_profit", np.int8),
+    ]
+)
+
+is_profit_by_code = {1: True, 0: False, -1: None}
+
+# numpy truncates longer strings silently
+string_fields = [field for field in trade_dtype.names if trade_dtype[field].kind == "U"]
+
+
+def check_string_width(field, values):
+    width = trade_dtype[field].itemsize // np.dtype("U1").itemsize
+    values = np.asarray(values)
+
+    # arrays of a narrower string dtype always fit
+    if (
+        values.dtype.kind == "U"
+        and values.dtype.itemsize <= trade_dtype[field].itemsize
+    ):
+        return
+
+    if values.size and np.char.str_len(values.astype(str)).max() > width:
+        raise ValueError(field, f"longer than {width} characters")
+
+
+def encode_is_profit(is_profit):
+    if is_profit is None:
+        return -1
+
+    return int(is_profit)
+
+
+class TradeLedger:
+    # trade history as a growing structured array instead of a list of dict,
+    # iterating still yields the dict Portfolio used to keep
+    def __init__(self, capacity=64):
+        self.trades = np.empty(capacity, trade_dtype)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for trade in self.records.tolist():
+            yield self.to_dict(trade)
+
+    def __getitem__(self, idx):
+        return self.to_dict(self.records[idx].tolist())
+
+    def to_dict(self, trade):
+        (
+            stock_id,
+            buy_price,
+            buy_unit,
+            buy_quarter,
+            sell_price,
+            sell_quarter,
+            is_profit,
+        ) = trade
+
+        return {
+            "stock_id": stock_id,
+            "buy_price": buy_price,
+            "buy_unit": buy_unit,
+            "buy_quarter": buy_quarter,
+            "sell_price": sell_price,
+            "sell_quarter": sell_quarter,
+            "is_profit": is_profit_by_code[is_profit],
+        }
+
+    @property
+    def records(self):
+        return self.trades[: self.count]
+
+    def reserve(self, count):
+        if self.count + count <= len(self.trades):
+            return
+
+        trades = np.empty(max(len(self.trades) * 2, self.count + count), trade_dtype)
+        trades[: self.count] = self.records
+        self.trades = trades
+
+    def append(self, trade):
+        # trade: dict of Portfolio.trade_history
+        for field in string_fields:
+            check_string_width(field, trade[field])
+
+        self.reserve(1)
+
+        self.trades[self.count] = (
+            trade["stock_id"],
+            trade["buy_price"],
+            trade["buy_unit"],
+            trade["buy_quarter"],
+            trade["sell_price"],
+            trade["sell_quarter"],
+            encode_is_profit(trade["is_profit"]),
+        )
+        self.count += 1
+
+    def extend(self, **columns):
+        # columns: one array per field of trade_dtype, e.g. trades of VectorPortfolio
+        count = len(columns["stock_id"])
+        for field in string_fields:
+            check_string_width(field, columns[field])
+
+        self.reserve(count)
+
+        trades = self.trades[self.count : self.count + count]
+        for field in trade_dtype.names:
+            trades[field] = columns[field]
+
+        self.count += count
+
+    def column(self, field):
+        return self.records[field]
+
+    def filter(self, mask):
+        ledger = TradeLedger(max(int(mask.sum()), 1))
+        ledger.extend(
+            **{field: self.records[field][mask] for field in trade_dtype.names}
+        )
+
+        return ledger
+
+    def by_stock(self, stock_id):
+        return self.filter(self.records["stock_id"] == stock_id)
+
+    def by_sell_quarter(self, quarter):
+        return self.filter(self.records["sell_quarter"] == quarter)
+
+    def losing(self):
+        return self.filter(self.records["is_profit"] == 0)
+
+    def winning(self):
+        return self.filter(self.records["is_profit"] == 1)
+
+    def to_df(self):
+        trades_df = pd.DataFrame(self.records)
+
+        # nullable boolean, NA if price can not be found
+        trades_df["is_profit"] = pd.array(
+            np.where(trades_df["is_profit"] < 0, None, trades_df["is_profit"] == 1),
+            dtype="boolean",
+        )
+
+        return trades_df
+
+    def to_parquet(self, path):
+        self.to_df().to_parquet(path, index=False)
@@ -0,0 +1,112 @@
+from datetime import timezone
+import numpy as np
+import pandas as pd
+
+
+def to_naive_utc(date):
+    # mongo compares naive datetime as UTC
+    if date.tzinfo:
+        return date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date
+
+
+def pivot_daily_trades(trades_df, dates=None):
+    # trades_df: one row per (date, branch) with net quantities in "net"
+    # same as building a dict per day: last row of the same branch wins,
+    # columns keep the order they first appear
+    # dates: every chips day, days without any row are kept as rows of 0
+    trades_df = trades_df.drop_duplicates(["date", "branch"], keep="last")
+    columns = pd.unique(trades_df["branch"])
+
+    daily_trades_df = trades_df.pivot(index="date", columns="branch", values="net")
+    daily_trades_df = daily_trades_df.reindex(columns=columns)
+    daily_trades_df.index.name = None
+    daily_trades_df.columns.name = None
+
+    if dates is not None:
+        daily_trades_df = daily_trades_df.reindex(dates, fill_value=0)
+
+    return daily_trades_df
+
+
+def to_datetime_index(dates, tz):
+    # naive datetime from mongo or other repositories is UTC
+    index = pd.DatetimeIndex(dates)
+
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+
+    return index.tz_convert(tz)
+
+
+def load_daily_prices_df(batches, tz):
+    # batches: lists of daily price documents sorted by date
+    dates = []
+    prices = []
+
+    for batch in batches:
+        dates.append(to_datetime_index([price["日期"] for price in batch], "UTC"))
+        prices.append(
+            np.fromiter((price["收盤價"] for price in batch), np.float64, len(batch))
+        )
+
+    if not dates:
+        return pd.DataFrame(
+            {"price": np.array([], np.float64)}, index=pd.DatetimeIndex([], tz=tz)
+        )
+
+    index = dates[0].append(dates[1:]).tz_convert(tz)
+
+    return pd.DataFrame({"price": np.concatenate(prices)}, index=index)
+
+
+def load_daily_trades_df(batches, find_row_id):
+    # batches: lists of chips documents sorted by date,
+    # one long format row per (date, branch) and a single pivot
+    chip_dates = []
+    dates = []
+    branches = []
+    nets = []
+
+    for batch in batches:
+        rows_count = np.fromiter(
+            (len(chip["data"]) for chip in batch), np.int64, len(batch)
+        )
+        batch_dates = np.array(
+            [to_naive_utc(chip["日期"]) for chip in batch], dtype="datetime64[ns]"
+        )
+
+        chip_dates.append(batch_dates)
+        dates.append(np.repeat(batch_dates, rows_count))
+        branches.append(
+            np.array(
+                [find_row_id(row) for chip in batch for row in chip["data"]],
+                dtype=object,
+            )
+        )
+        nets.append(
+            np.fromiter(
+                (row["買張"] - row["賣張"] for chip in batch for row in chip["data"]),
+                np.int64,
+                rows_count.sum(),
+            )
+        )
+
+    if not dates:
+        return pd.DataFrame()
+
+    trades_df = pd.DataFrame(
+        {
+            "date": np.concatenate(dates),
+            "branch": np.concatenate(branches),
+            "net": np.concatenate(nets),
+        }
+    )
+
+    daily_trades_df = pivot_daily_trades(
+        trades_df, pd.DatetimeIndex(np.concatenate(chip_dates))
+    )
+    daily_trades_df.index = daily_trades_df.index.date
+
+    return daily_trades_df
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime
+from dateutil.rrule import rrule, DAILY
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# one date per line (e.g. 2022-02-01), lines start with '#' are ignored
+TWSE_HOLIDAY_FILE = os.environ.get("TWSE_HOLIDAY_FILE")
+
+prices_collection = "dailyPrices"
+
+
+def load_holidays(holiday_file):
+    holidays = set()
+
+    if not holiday_file or not os.path.exists(holiday_file):
+        return holidays
+
+    with open(holiday_file) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+
+            if line:
+                holidays.add(datetime.strptime(line, "%Y-%m-%d").date())
+
+    return holidays
+
+
+class TradingCalendar:
+    def __init__(self, open_days=(), holidays=()):
+        # days before first_open_day or after last_open_day are unknown, guess by weekday
+        self.open_days = set(open_days)
+        self.holidays = set(holidays)
+        self.first_open_day = min(self.open_days) if self.open_days else None
+        self.last_open_day = max(self.open_days) if self.open_days else None
+
+    @classmethod
+    def from_repository(
+        cls, repository, since_date=None, holiday_file=TWSE_HOLIDAY_FILE
+    ):
+        open_days = {
+            date.date()
+            for date in repository.distinct_dates(prices_collection, since_date)
+        }
+
+        return cls(open_days, load_holidays(holiday_file))
+
+    def is_known(self, day):
+        return self.first_open_day is not None and (
+            self.first_open_day <= day <= self.last_open_day
+        )
+
+    def is_open(self, day):
+        if day in self.holidays:
+            return False
+
+        if self.is_known(day):
+            return day in self.open_days
+
+        return day.weekday() < 5
+
+    def get_trading_days(self, since_date, until_date):
+        # same as rrule, keep the time of since_date
+        return [
+            dt
+            for dt in rrule(DAILY, dtstart=since_date, until=until_date)
+            if self.is_open(dt.date())
+        ]
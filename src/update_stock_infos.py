@@ -2,18 +2,27 @@ import os
 import time
 import traceback
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+import pandas as pd
 from dotenv import load_dotenv
 
-from stock_crawler import StockCrawler
-from stock import Stock
+from stock_crawler import StockCrawler, get_chips_concurrently
+from stock_batch import STOCK_CHUNK_SIZE
+from quarter_price import find_quarter_prices_df
+from trading_calendar import TradingCalendar
+import chips_bucket
+import branch_positions
+from branch_registry import BranchRegistry
+from http_client import print_connection_stats
+from cmoney_token import token_store
+from repository import get_repository
 
 load_dotenv()
 
-MONGO_URL = os.environ.get("MONGO_URL")
-
-mongo_client = MongoClient(MONGO_URL)
-db = mongo_client.get_default_database()
+# "buckets": keep chips only in chips_buckets collection, not in ParquetMirror,
+# see chips_bucket.py
+# "positions": also keep running branch positions, see branch_positions.py
+# "documents" or "aggregate": only chips collection
+CHIPS_LAYOUT = os.environ.get("CHIPS_LAYOUT") or "documents"
 
 date_column = "日期"
 stocks_collection = "stocks"
@@ -33,7 +42,7 @@ def get_stock_id():
     return stock_id
 
 
-def crawl_new_stock():
+def crawl_new_stock(repository):
     now = datetime.now()
 
     new_stock_id = input(f"new stock id: ")
@@ -43,15 +52,15 @@ def crawl_new_stock():
         raise ValueError(new_stock_id, "stock_id is missing")
 
     print(f"insert new stock into {stocks_collection} collection")
-    db[stocks_collection].update_one(
-        {
-            "stockId": "1342",
-        },
-        {
-            "stockId": "1342",
-            "shouldSkip": False,
-        },
-        upsert=True,
+    repository.upsert_many(
+        stocks_collection,
+        [
+            {
+                "stockId": new_stock_id,
+                "shouldSkip": False,
+            }
+        ],
+        ["stockId"],
     )
 
     new_since_date = input(f"new_since_date for chips (e.g. 2021-01-01): ")
@@ -61,14 +70,24 @@ def crawl_new_stock():
     print(f"new_since_date of chips: {new_since_date}")
     print(f"new_until_date of chips: {new_until_date}")
     print("get new stock chips")
-    stock_crawler = StockCrawler(new_stock_id, date_column)
+    stock_crawler = StockCrawler(
+        new_stock_id,
+        date_column,
+        TradingCalendar.from_repository(repository, new_since_date),
+        BranchRegistry(repository),
+    )
     new_chips = stock_crawler.get_chips(new_since_date, new_until_date)
 
     for chip in new_chips:
         chip["createdAt"] = now
 
-    if new_chips:
-        db[chips_collection].insert_many(new_chips)
+    if new_chips and CHIPS_LAYOUT == "buckets":
+        # buckets only exist in mongo
+        chips_bucket.add_chips_to_buckets(
+            repository.db, new_chips, stock_crawler.branch_registry
+        )
+    elif new_chips:
+        repository.upsert_many(chips_collection, new_chips, ["stockId", date_column])
 
     new_since_date = input(f"new_since_date for prices (e.g. 2012-01-01): ")
     new_since_date = datetime.strptime(new_since_date, "%Y-%m-%d")
@@ -84,33 +103,41 @@ def crawl_new_stock():
         price["createdAt"] = now
 
     if new_format_daily_prices:
-        db[prices_collection].insert_many(new_format_daily_prices)
+        repository.upsert_many(
+            prices_collection, new_format_daily_prices, ["stockId", date_column]
+        )
 
 
 def main():
+    repository = get_repository()
 
     # new stock ######################################################
     is_new_stock = input(f"should crawl new stock (y/n) ?")
 
     if is_new_stock == "y":
-        crawl_new_stock()
+        crawl_new_stock(repository)
 
     stock_id_input = get_stock_id()
     now = datetime.now()
 
     if stock_id_input == "all":
-        existed_stocks = db[stocks_collection].find(
-            {"shouldSkip": False}, sort=[("stockId", 1)]
-        )
-        #  existed_stocks = db[stocks_collection].find({}, sort=[("stockId", 1)])
+        existed_stocks = repository.find_stocks(should_skip=False)
+        #  existed_stocks = repository.find_stocks()
         existed_stock_ids = list(map(lambda stock: stock["stockId"], existed_stocks))
     else:
         existed_stock_ids = [stock_id_input]
 
     stock_crawlers = []
 
+    # only crawl chips on days market is open
+    trading_calendar = TradingCalendar.from_repository(repository)
+    # store branch id in chips instead of branch code and name
+    branch_registry = BranchRegistry(repository)
+
     for stock_id in existed_stock_ids:
-        stock_crawler = StockCrawler(stock_id, date_column)
+        stock_crawler = StockCrawler(
+            stock_id, date_column, trading_calendar, branch_registry
+        )
 
         stock_crawlers.append(stock_crawler)
 
@@ -135,40 +162,96 @@ def main():
     if should_continue == "y":
         print("update stock chips")
 
-        for stock_crawler in stock_crawlers:
-            stock_id = stock_crawler.stock_id
-            print(f"stock id: {stock_id}")
+        use_async = input("crawl chips concurrently (y/n) ?")
+
+        def get_chips_since_date(stock_id):
+            if since_date:
+                return since_date
 
-            try:
-                latest_data = db[chips_collection].find_one(
-                    {"stockId": stock_id}, sort=[(date_column, -1)]
+            if CHIPS_LAYOUT == "buckets":
+                latest_date = chips_bucket.find_latest_date(repository.db, stock_id)
+            else:
+                latest_data = repository.find_latest(chips_collection, stock_id)
+                latest_date = latest_data[date_column]
+
+            return latest_date + timedelta(days=1)
+
+        chips_writer = repository.bulk_upserter(
+            chips_collection, ["stockId", date_column]
+        )
+        # stock id: since date of the chips written in this run
+        saved_since_dates = {}
+
+        def save_chips(chips):
+            for chip in chips:
+                stock_id = chip["stockId"]
+                saved_since_dates[stock_id] = min(
+                    saved_since_dates.get(stock_id, chip[date_column]),
+                    chip[date_column],
                 )
 
-                if since_date:
-                    tmp_since_date = since_date
-                else:
-                    tmp_since_date = latest_data[date_column] + timedelta(days=1)
+                chip["createdAt"] = now
+
+            if CHIPS_LAYOUT == "buckets":
+                # buckets only exist in mongo
+                chips_bucket.add_chips_to_buckets(repository.db, chips, branch_registry)
+            else:
+                chips_writer.add_many(chips)
+
+        if use_async == "y":
+            jobs = []
+
+            for stock_crawler in stock_crawlers:
+                try:
+                    tmp_since_date = get_chips_since_date(stock_crawler.stock_id)
+                except Exception:
+                    traceback.print_exc()
+                    continue
+
+                jobs.append((stock_crawler, tmp_since_date))
 
-                print(f"since_date: {tmp_since_date}")
-                print(f"until_date: {until_date}")
+            def on_chips(stock_crawler, chips):
+                print(f"stock id: {stock_crawler.stock_id} chips done")
 
-                chips = stock_crawler.get_chips(tmp_since_date, until_date)
+                if isinstance(chips, Exception):
+                    traceback.print_exception(type(chips), chips, chips.__traceback__)
+                    return
 
-                for chip in chips:
-                    chip["createdAt"] = now
+                try:
+                    save_chips(chips)
+                except Exception:
+                    traceback.print_exc()
+
+            print(f"until_date: {until_date}")
+            get_chips_concurrently(jobs, until_date, on_chips)
+        else:
+            for stock_crawler in stock_crawlers:
+                stock_id = stock_crawler.stock_id
+                print(f"stock id: {stock_id}")
 
-                    db[chips_collection].update_one(
-                        {
-                            "stockId": chip["stockId"],
-                            date_column: chip[date_column],
-                        },
-                        {
-                            "$setOnInsert": chip,
-                        },
-                        upsert=True,
+                try:
+                    tmp_since_date = get_chips_since_date(stock_id)
+
+                    print(f"since_date: {tmp_since_date}")
+                    print(f"until_date: {until_date}")
+
+                    chips = stock_crawler.get_chips(tmp_since_date, until_date)
+
+                    save_chips(chips)
+                except Exception:
+                    traceback.print_exc()
+
+        chips_writer.flush()
+        print(f"upsert {chips_writer.upserted_count} chips")
+
+        if CHIPS_LAYOUT == "positions":
+            for stock_id, saved_since_date in saved_since_dates.items():
+                try:
+                    branch_positions.update_positions(
+                        repository, stock_id, branch_registry, saved_since_date
                     )
-            except Exception:
-                traceback.print_exc()
+                except Exception:
+                    traceback.print_exc()
 
     # price ######################################################
     should_continue = input(f"should update stock '{stock_id_input}' prices (y/n) ?")
@@ -176,6 +259,10 @@ def main():
     if should_continue == "y":
         print(f"update stock daily prices in collection {prices_collection}")
 
+        prices_writer = repository.bulk_upserter(
+            prices_collection, ["stockId", date_column]
+        )
+
         for stock_crawler in stock_crawlers:
             stock_id = stock_crawler.stock_id
             print(f"stock id: {stock_id}")
@@ -183,9 +270,7 @@ def main():
             if int(stock_id) <= 1100:
                 continue
 
-            latest_data = db[prices_collection].find_one(
-                {"stockId": stock_id}, sort=[(date_column, -1)]
-            )
+            latest_data = repository.find_latest(prices_collection, stock_id)
 
             if since_date:
                 tmp_since_date = since_date
@@ -202,19 +287,10 @@ def main():
             for price in format_daily_prices:
                 price["createdAt"] = now
 
-                db[prices_collection].update_one(
-                    {
-                        "stockId": price["stockId"],
-                        date_column: price[date_column],
-                    },
-                    {
-                        "$setOnInsert": price,
-                    },
-                    upsert=True,
-                )
+                prices_writer.add(price)
 
-            #  if format_daily_prices:
-            #      db[prices_collection].insert_many(format_daily_prices)
+        prices_writer.flush()
+        print(f"upsert {prices_writer.upserted_count} daily prices")
 
     # reports ######################################################
     should_continue = input(
@@ -223,7 +299,7 @@ def main():
 
     if should_continue == "y":
         if stock_id_input == "all":
-            stocks = list(db.stocks.find().sort([("stockId", 1)]))
+            stocks = repository.find_stocks()
         else:
             stocks = [{"stockId": stock_id_input}]
 
@@ -231,6 +307,12 @@ def main():
         start_year = 2012
         end_year = 2021
 
+        infos_writer = repository.bulk_upserter(
+            "stock_infos_quarter", ["stockId", "會計年季度"]
+        )
+        # (stock id, quarter) of crawled reports, prices are found at once after the loop
+        stock_quarters = []
+
         for stock in stocks:
             stock_id = stock["stockId"]
 
@@ -263,44 +345,48 @@ def main():
                 #      "單季EPS季增率",
                 #  ]
 
-                db.stock_infos_quarter.update_one(
-                    {
-                        "stockId": stock_id,
-                        "會計年季度": quarter,
-                    },
-                    {
-                        "$setOnInsert": info,
-                        #  "$set": {new_key: info[new_key] for new_key in new_keys},
-                    },
-                    upsert=True,
-                )
+                infos_writer.add(info)
 
-                stock = Stock(db, stock_id)
-
-                stock_price = stock.get_price_from_daily_collection(quarter)
-
-                if stock_price:
-                    db.prices_quarter.update_one(
-                        {
-                            "stockId": stock_id,
-                            "會計年季度": quarter,
-                        },
-                        {
-                            "$setOnInsert": {
-                                "stockId": stock_id,
-                                "會計年季度": quarter,
-                                "price": stock_price["收盤價"],
-                                "createdAt": now,
-                            }
-                        },
-                        upsert=True,
-                    )
-                else:
-                    print(f"missing price in stockId {stock_id}, quarter {quarter}")
+                stock_quarters.append((stock_id, quarter))
 
             time.sleep(0.1)
 
-    mongo_client.close()
+        infos_writer.flush()
+
+        prices_quarter_writer = repository.bulk_upserter(
+            "prices_quarter", ["stockId", "會計年季度"]
+        )
+
+        quarter_prices_df = find_quarter_prices_df(
+            repository, stock_quarters, STOCK_CHUNK_SIZE
+        )
+
+        for stock_id, quarter, price in zip(
+            quarter_prices_df["stockId"],
+            quarter_prices_df["會計年季度"],
+            quarter_prices_df["收盤價"].tolist(),
+        ):
+            if pd.isna(price):
+                print(f"missing price in stockId {stock_id}, quarter {quarter}")
+                continue
+
+            prices_quarter_writer.add(
+                {
+                    "stockId": stock_id,
+                    "會計年季度": quarter,
+                    "price": price,
+                    "createdAt": now,
+                }
+            )
+
+        prices_quarter_writer.flush()
+        print(f"upsert {infos_writer.upserted_count} stock infos quarter")
+        print(f"upsert {prices_quarter_writer.upserted_count} prices quarter")
+
+    print_connection_stats()
+    print(f"cmoney login count: {token_store.login_count}")
+
+    repository.close()
 
 
 if __name__ == "__main__":
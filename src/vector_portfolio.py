@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+
+from price_index import MISSING_PRICE
+from trade_ledger import TradeLedger
+
+
+def get_price_panel(prices, quarters, stock_ids):
+    # prices: {(stock id, quarter): price}, e.g. PriceIndex.prices,
+    # quarter x stock, MISSING_PRICE if price can not be found
+    return pd.DataFrame(
+        [
+            [prices.get((stock_id, quarter), MISSING_PRICE) for stock_id in stock_ids]
+            for quarter in quarters
+        ],
+        index=list(quarters),
+        columns=list(stock_ids),
+        dtype=np.float64,
+    )
+
+
+class VectorPortfolio:
+    # same results as Portfolio, holdings are arrays of stock index in price_panel
+    def __init__(self, price_panel, init_money):
+        self.price_panel = price_panel
+        self.prices = price_panel.to_numpy(np.float64)
+        self.stock_ids = price_panel.columns.to_numpy(object)
+        self.stock_idx_by_id = {
+            stock_id: idx for idx, stock_id in enumerate(self.stock_ids)
+        }
+        self.quarters = price_panel.index.to_numpy(object)
+        self.quarter_idx_by_quarter = {
+            quarter: idx for idx, quarter in enumerate(self.quarters)
+        }
+
+        self.current_cash = init_money
+        self.assets_history = []
+
+        # holdings
+        self.stock_idx = np.array([], np.int64)
+        self.buy_units = np.array([], np.float64)
+        self.buy_prices = np.array([], np.float64)
+        self.buy_quarter_idx = np.array([], np.int64)
+
+        self.trade_history = TradeLedger()
+
+        # running stats of trades, updated on every sell
+        self.realized_profit = 0.0
+        self.win_count = 0
+        self.trade_count = 0
+        # end quarter: profit of each holding, cleared when holdings change
+        self.holding_profits_cache = {}
+
+    def get_prices(self, stock_idx, quarter):
+        if quarter not in self.quarter_idx_by_quarter:
+            return np.full(len(stock_idx), MISSING_PRICE, np.float64)
+
+        return self.prices[self.quarter_idx_by_quarter[quarter], stock_idx]
+
+    def check_missing_prices(self, stock_idx, prices, quarter):
+        # same as price_after_quarter_report(quarter, raise_error=True)
+        missing = prices == MISSING_PRICE
+
+        if missing.any():
+            stock_id = self.stock_ids[stock_idx[missing.argmax()]]
+            raise ValueError(f"missing price in stockId {stock_id}, quarter {quarter}")
+
+    def buy_stocks(self, buy_stock_ids, quarter):
+        cash_use_in_each_stock = self.current_cash / len(buy_stock_ids)
+
+        stock_idx = np.array(
+            [self.stock_idx_by_id.get(stock_id, -1) for stock_id in buy_stock_ids],
+            np.int64,
+        )
+
+        if (stock_idx < 0).any():
+            stock_id = buy_stock_ids[(stock_idx < 0).argmax()]
+            raise ValueError(f"missing price in stockId {stock_id}, quarter {quarter}")
+
+        prices = self.get_prices(stock_idx, quarter)
+        self.check_missing_prices(stock_idx, prices, quarter)
+
+        # python round, np.round may differ in the last digit
+        buy_units = np.array(
+            [round(unit, 4) for unit in (cash_use_in_each_stock / prices).tolist()],
+            np.float64,
+        )
+
+        self.stock_idx = np.concatenate([self.stock_idx, stock_idx])
+        self.buy_units = np.concatenate([self.buy_units, buy_units])
+        self.buy_prices = np.concatenate([self.buy_prices, prices])
+        self.buy_quarter_idx = np.concatenate(
+            [
+                self.buy_quarter_idx,
+                np.full(len(stock_idx), self.quarter_idx_by_quarter[quarter], np.int64),
+            ]
+        )
+
+        self.current_cash = 0
+        self.holding_profits_cache = {}
+
+    def sell_all_stocks(self, quarter):
+        prices = self.get_prices(self.stock_idx, quarter)
+        missing = prices == MISSING_PRICE
+
+        # FIXME: same as Portfolio, should get last price before stock disappeared
+        sell_values = self.buy_units * np.where(missing, self.buy_prices, prices)
+
+        # cumsum adds one by one like Portfolio, sum may differ in the last digit
+        self.current_cash = float(
+            np.cumsum(np.append(self.current_cash, sell_values))[-1]
+        )
+
+        if len(self.stock_idx):
+            sell_prices = np.where(missing, MISSING_PRICE, prices)
+            is_profits = np.where(missing, -1, self.buy_prices < prices)
+
+            self.trade_history.extend(
+                stock_id=self.stock_ids[self.stock_idx],
+                buy_price=self.buy_prices,
+                buy_unit=self.buy_units,
+                buy_quarter=self.quarters[self.buy_quarter_idx],
+                sell_price=sell_prices,
+                sell_quarter=quarter,
+                is_profit=is_profits,
+            )
+
+            trade_profits = (sell_prices - self.buy_prices) * self.buy_units
+            self.realized_profit = float(
+                np.cumsum(np.append(self.realized_profit, trade_profits))[-1]
+            )
+            self.win_count += int((is_profits == 1).sum())
+            self.trade_count += len(self.stock_idx)
+
+        self.stock_idx = np.array([], np.int64)
+        self.buy_units = np.array([], np.float64)
+        self.buy_prices = np.array([], np.float64)
+        self.buy_quarter_idx = np.array([], np.int64)
+        self.holding_profits_cache = {}
+
+        self.assets_history.append(
+            {
+                "assets": round(self.current_cash, 4),
+                "quarter": quarter,
+            }
+        )
+
+    def get_holding_profits(self, end_quarter):
+        # mark-to-market of holdings, computed once per end quarter
+        if end_quarter not in self.holding_profits_cache:
+            prices = self.get_prices(self.stock_idx, end_quarter)
+            self.check_missing_prices(self.stock_idx, prices, end_quarter)
+
+            # same as Portfolio, holdings count buy price - price
+            self.holding_profits_cache[end_quarter] = (
+                self.buy_prices - prices
+            ) * self.buy_units
+
+        return self.holding_profits_cache[end_quarter]
+
+    def get_history_profit(self, end_quarter):
+        holding_profits = self.get_holding_profits(end_quarter)
+
+        profit = float(np.cumsum(np.append(self.realized_profit, holding_profits))[-1])
+
+        return round(profit, 4)
+
+    @property
+    def win_rate(self):
+        return round(self.win_count / self.trade_count, 4)